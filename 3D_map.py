@@ -2,20 +2,91 @@
 # -*- coding: utf-8 -*-
 
 """
-3D Map v1.2
+3D Map v1.3
 
 Creates a 3D polygon chart. THe example code creates a map of a home and shows how you can color the polygons for
 temperature or humidity using a color map.
 
-Note: this script requires Python 3.x and, if saving animation to disk, ffmpeg.
+All rooms are drawn as one collection whose projection is cached per view, so re-renders and animation loops
+of the (fixed) floor plan only recolor the faces instead of projecting every vertex again.
+
+Set `TIMELAPSE_FILE` to render a time-lapse of recorded readings instead of a still image (see Time-lapse below).
+
+Note: this script requires Python 3.x, `output_writer.py` and, if saving animation to disk as video, ffmpeg.
 """
 
 # import sys  # uncomment if using the sys.argv statement below
+from collections import OrderedDict
+from datetime import timedelta
+from hashlib import sha1
+from io import BytesIO
+import os
+import tempfile
 import numpy as np
 import matplotlib.pyplot as plt
+from mpl_toolkits.mplot3d import proj3d
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+from matplotlib.collections import PolyCollection
 from matplotlib.colors import Normalize
-# from matplotlib import animation  # uncomment if using the animation code below
+from matplotlib import animation
+from output_writer import write_output
+from script_metrics import ScriptMetrics
+
+# Number of views whose projections are kept. A full rotation at the animation's 1/4 degree steps is 1440.
+PROJECTION_CACHE_SIZE = 4096
+
+# (projection matrix bytes, geometry hash) -> (2D faces in draw order, draw order, minimum depth)
+_projection_cache = OrderedDict()
+
+
+# ==============================================================================
+class CachedPoly3DCollection(Poly3DCollection):
+    """
+    A Poly3DCollection that caches its projected 2D polygons and depth order for each view.
+
+    The room geometry never changes, so the projection only depends on the axes' projection matrix (`axes.M`, which
+    covers the camera angle, distance/focal length, axis limits, box aspect and figure size). When a view has been
+    drawn before (repeated renders, animation loops), the stored projection is reused and only the face colors are
+    swapped in.
+    """
+
+    def __init__(self, verts, face_colors, alpha=1.0, **kwargs):
+        # `alpha` has to come after `ec` so that it only applies to the faces.
+        super().__init__(verts, **kwargs, fc=face_colors, alpha=alpha)
+        self.vertices = np.asarray(verts, dtype=float)
+        self.geometry_hash = sha1(self.vertices.tobytes()).hexdigest()
+        self.face_alpha = alpha
+        self.set_face_colors(face_colors)
+
+    def set_face_colors(self, face_colors):
+        """Replace the face colors (RGBA array, one row per face) without touching the geometry."""
+        self.face_rgba = np.array(face_colors, dtype=float)
+        self.face_rgba[:, 3] = self.face_alpha
+        self.stale = True
+
+    def do_3d_projection(self):
+        """Project the faces for the current view, or reuse the projection cached for it."""
+        axes = self.axes
+        key = (axes.M.tobytes(), self.geometry_hash)
+        cached = _projection_cache.get(key)
+
+        if cached is None:
+            xs, ys, zs = self.vertices.reshape(-1, 3).T
+            projected = np.stack(proj3d.proj_transform(xs, ys, zs, axes.M), axis=-1).reshape(self.vertices.shape)
+            depth = projected[..., 2]
+            order = np.argsort(depth.mean(axis=-1))[::-1]  # painter's algorithm: farthest face first
+            cached = (projected[order, :, :2], order, float(np.min(depth)))
+            _projection_cache[key] = cached
+            if len(_projection_cache) > PROJECTION_CACHE_SIZE:
+                _projection_cache.popitem(last=False)
+
+        faces_2d, order, min_depth = cached
+        PolyCollection.set_verts(self, faces_2d, self._closed)
+        self._facecolors2d = self.face_rgba[order]
+        # Per-face edge colors follow the faces' draw order; a single edge color applies to all of them.
+        edge_colors = self._edgecolor3d
+        self._edgecolors2d = edge_colors[order] if len(edge_colors) == len(order) else edge_colors
+        return min_depth
 
 
 # ==============================================================================
@@ -32,13 +103,77 @@ def animate(frame):
 
 
 # ==============================================================================
-def plot_shape(coords, obs):
+def timelapse_frame(frame, history, title, step):
+    """
+    Time-lapse animation function. Only the face colors (and, optionally, the camera) change between frames.
+
+    :param frame:
+    :param history:
+    :param title:
+    :param step:
+    :return:
+    """
+    timestep = frame * step
+    rooms.set_face_colors(face_colors(history[:, timestep]))
+    if TIMELAPSE_ROTATE:
+        ax.view_init(elev=30, azim=frame / 4)
+    if TIMELAPSE_START:
+        title.set_text(f"{TIMELAPSE_START + timedelta(minutes=TIMELAPSE_INTERVAL * timestep):%Y-%m-%d %H:%M}")
+    return rooms, title
+
+
+# ==============================================================================
+def render_timelapse():
+    """
+    Render the readings in `TIMELAPSE_FILE` to `TIMELAPSE_OUTPUT`.
+
+    The file is memory-mapped, so readings are read one timestep (column) at a time as frames are drawn. Frames are
+    piped to ffmpeg as they're drawn (for GIFs too). Without ffmpeg, GIFs are built with Pillow, which keeps every
+    frame in memory until the end, so the time-lapse is downsampled to at most `TIMELAPSE_MAX_PILLOW_FRAMES` frames.
+
+    :return:
     """
-    Plot all sides of each polygon
+    history = np.load(TIMELAPSE_FILE, mmap_mode='r')
+    if history.ndim != 2 or history.shape[0] != len(ROOMS):
+        raise SystemExit(f"{TIMELAPSE_FILE} must hold a {len(ROOMS)} (rooms) x timesteps array.")
+
+    step = TIMELAPSE_STEP
+    if animation.writers.is_available('ffmpeg'):
+        writer = animation.FFMpegWriter(fps=TIMELAPSE_FPS, metadata=dict(title='3D Temperature Time-lapse'))
+    elif TIMELAPSE_OUTPUT.lower().endswith('.gif'):
+        writer = animation.PillowWriter(fps=TIMELAPSE_FPS)
+        step = max(step, -(-history.shape[1] // TIMELAPSE_MAX_PILLOW_FRAMES))
+        if step != TIMELAPSE_STEP:
+            print(f"ffmpeg isn't available; using one reading in {step} to keep the GIF in memory.")
+    else:
+        raise SystemExit(f"ffmpeg is required to write {TIMELAPSE_OUTPUT}.")
+
+    title = ax.set_title('')
+    frames = (history.shape[1] + step - 1) // step
+    metrics.count("frames", frames)
+    ani = animation.FuncAnimation(fig, timelapse_frame, frames=frames, fargs=(history, title, step), repeat=False)
+
+    # Render to a hidden file next to the target (with the same extension, which the writer uses to pick the format),
+    # then hand it to `write_output()` so the target is replaced atomically and only when it changed.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(TIMELAPSE_OUTPUT) or '.', prefix='.',
+                                    suffix=os.path.splitext(TIMELAPSE_OUTPUT)[1])
+    os.close(fd)
+    try:
+        ani.save(tmp_path, writer=writer)
+        metrics.mark("write")
+        with open(tmp_path, 'rb') as infile:
+            write_output(TIMELAPSE_OUTPUT, iter(lambda: infile.read(1024 * 1024), b''))
+    finally:
+        os.unlink(tmp_path)
+
+
+# ==============================================================================
+def shape_faces(coords):
+    """
+    Build the six faces of a room
     Credit: https://stackoverflow.com/a/49766400/2827397
 
     :param coords:
-    :param obs:
     :return:
     """
 
@@ -60,7 +195,7 @@ def plot_shape(coords, obs):
 
     points = np.array(points)
 
-    edges = [
+    return [
         [points[0], points[3], points[5], points[1]],
         [points[1], points[5], points[7], points[4]],
         [points[4], points[2], points[6], points[7]],
@@ -69,15 +204,42 @@ def plot_shape(coords, obs):
         [points[3], points[6], points[7], points[5]]
     ]
 
-    faces = Poly3DCollection(edges, lw=.3, ec='k', fc=cmap(norm(obs)), alpha=.2)
-    ax.add_collection3d(faces)
+
+# ==============================================================================
+def face_colors(obs):
+    """
+    Map one observation per room to one color per face (six faces per room)
+
+    :param obs:
+    :return:
+    """
+    return cmap(norm(np.repeat(np.asarray(obs, dtype=float), 6)))
+
+
+# ==============================================================================
+def plot_rooms(rooms):
+    """
+    Plot all rooms as one collection. The geometry is built once; recolor it with `set_face_colors(face_colors(obs))`.
+
+    :param rooms:
+    :return:
+    """
+    faces = np.array([face for coords, _ in rooms for face in shape_faces(coords)], dtype=float)
+
+    collection = CachedPoly3DCollection(faces, face_colors([obs for _, obs in rooms]), lw=.3, ec='k', alpha=.2)
+    ax.add_collection3d(collection)
 
     # Plot the points themselves to force the scaling of the axes. We set their size to zero, so they are invisible.
+    points = faces.reshape(-1, 3)
     ax.scatter(points[:, 0], points[:, 1], points[:, 2], s=0)
 
     ax.set_aspect('auto')
+    return collection
 
 
+metrics = ScriptMetrics("3D_map")
+metrics.mark("geometry")
+
 # data = sys.argv[1]
 fig = plt.figure()
 ax = fig.add_subplot(111, projection='3d')
@@ -99,33 +261,39 @@ norm = Normalize(vmin=50, vmax=80)
 #               (x origin, y length, z origin),
 #               (x origin, y origin, z height)
 #               ]
-
-# Lower Level
-plot_shape(coords=[(24, 20, 0), (48, 20, 0), (24, 50, 0), (24, 20, 10)], obs=62)  # basement
-plot_shape(coords=[(48, 20, 0), (62, 20, 0), (48, 50, 0), (48, 20, 10)], obs=58)  # workshop
-
-# First Floor
-plot_shape(coords=[(24, 35, 10), (37, 35, 10), (24, 50, 10), (24, 35, 18)], obs=67)  # dining room
-plot_shape(coords=[(0, 24, 10), (24, 24, 10), (0, 48, 10), (0, 24, 20)], obs=56)     # garage
-plot_shape(coords=[(37, 20, 10), (48, 20, 10), (37, 35, 10), (37, 20, 18)], obs=67)  # foyer down
-plot_shape(coords=[(37, 35, 10), (48, 35, 10), (37, 50, 10), (37, 35, 18)], obs=68)  # kitchen
-plot_shape(coords=[(24, 30, 10), (30, 30, 10), (24, 35, 10), (24, 30, 18)], obs=68)  # laundry
-plot_shape(coords=[(48, 20, 10), (62, 20, 10), (48, 50, 10), (48, 20, 18)], obs=68)  # living room
-plot_shape(coords=[(24, 20, 10), (37, 20, 10), (24, 30, 10), (24, 20, 18)], obs=69)  # parlor
-plot_shape(coords=[(30, 30, 10), (37, 30, 10), (30, 35, 10), (30, 30, 18)], obs=68)  # powder
-
-# Second Floor
-plot_shape(coords=[(37, 20, 18), (48, 20, 18), (37, 35, 18), (37, 20, 26)], obs=71)  # foyer up
-plot_shape(coords=[(24, 35, 18), (37, 35, 18), (24, 50, 18), (24, 35, 26)], obs=68)  # guest br
-plot_shape(coords=[(24, 30, 18), (37, 30, 18), (24, 35, 18), (24, 30, 26)], obs=68)  # guest bath
-plot_shape(coords=[(37, 35, 18), (48, 35, 18), (37, 50, 18), (37, 35, 26)], obs=67)  # master bath
-plot_shape(coords=[(48, 20, 18), (62, 20, 18), (48, 42, 18), (48, 20, 26)], obs=71)  # master br
-plot_shape(coords=[(48, 42, 18), (62, 42, 18), (48, 50, 18), (48, 42, 26)], obs=68)  # master closet
-plot_shape(coords=[(24, 20, 18), (37, 20, 18), (24, 30, 18), (24, 20, 26)], obs=68)  # office
-
-# Attics
-plot_shape(coords=[(0, 24, 20), (24, 24, 20), (0, 48, 20), (0, 24, 30)], obs=65)  # garage attic
-plot_shape(coords=[(24, 20, 26), (62, 20, 26), (24, 50, 26), (24, 20, 36)], obs=75)  # main attic
+# Each entry is (coordinates, observation).
+
+ROOMS = [
+    # Lower Level
+    ([(24, 20, 0), (48, 20, 0), (24, 50, 0), (24, 20, 10)], 62),  # basement
+    ([(48, 20, 0), (62, 20, 0), (48, 50, 0), (48, 20, 10)], 58),  # workshop
+
+    # First Floor
+    ([(24, 35, 10), (37, 35, 10), (24, 50, 10), (24, 35, 18)], 67),  # dining room
+    ([(0, 24, 10), (24, 24, 10), (0, 48, 10), (0, 24, 20)], 56),     # garage
+    ([(37, 20, 10), (48, 20, 10), (37, 35, 10), (37, 20, 18)], 67),  # foyer down
+    ([(37, 35, 10), (48, 35, 10), (37, 50, 10), (37, 35, 18)], 68),  # kitchen
+    ([(24, 30, 10), (30, 30, 10), (24, 35, 10), (24, 30, 18)], 68),  # laundry
+    ([(48, 20, 10), (62, 20, 10), (48, 50, 10), (48, 20, 18)], 68),  # living room
+    ([(24, 20, 10), (37, 20, 10), (24, 30, 10), (24, 20, 18)], 69),  # parlor
+    ([(30, 30, 10), (37, 30, 10), (30, 35, 10), (30, 30, 18)], 68),  # powder
+
+    # Second Floor
+    ([(37, 20, 18), (48, 20, 18), (37, 35, 18), (37, 20, 26)], 71),  # foyer up
+    ([(24, 35, 18), (37, 35, 18), (24, 50, 18), (24, 35, 26)], 68),  # guest br
+    ([(24, 30, 18), (37, 30, 18), (24, 35, 18), (24, 30, 26)], 68),  # guest bath
+    ([(37, 35, 18), (48, 35, 18), (37, 50, 18), (37, 35, 26)], 67),  # master bath
+    ([(48, 20, 18), (62, 20, 18), (48, 42, 18), (48, 20, 26)], 71),  # master br
+    ([(48, 42, 18), (62, 42, 18), (48, 50, 18), (48, 42, 26)], 68),  # master closet
+    ([(24, 20, 18), (37, 20, 18), (24, 30, 18), (24, 20, 26)], 68),  # office
+
+    # Attics
+    ([(0, 24, 20), (24, 24, 20), (0, 48, 20), (0, 24, 30)], 65),  # garage attic
+    ([(24, 20, 26), (62, 20, 26), (24, 50, 26), (24, 20, 36)], 75),  # main attic
+]
+
+rooms = plot_rooms(ROOMS)
+metrics.count("rooms", len(ROOMS))
 
 # ================================= Occupancy ==================================
 # This is the occupancy point (as an example). Plot point at middle of room dimension:
@@ -156,5 +324,29 @@ ax.zaxis.set_pane_color((1, 1, 1, 1))
 # ani = animation.FuncAnimation(fig, animate, frames=1500, interval=24, repeat=True)
 # ani.save('/Users/Dave/Temp/anim_24_1500_60fps.mp4')
 
-# plt.show()
-plt.savefig('/Users/Dave/Temp/Figure 1 Planar.png')
+# ================================= Time-lapse =================================
+# A NumPy `.npy` file holding a rooms x timesteps array of readings, with one row per entry in `ROOMS` (in the same
+# order). Store it as float32 to keep it compact: a month of 5-minute readings for 300 rooms is about 10 MB. Leave as
+# None to render a still image.
+TIMELAPSE_FILE = None
+TIMELAPSE_STEP = 1          # Use every Nth timestep (downsampling).
+TIMELAPSE_START = None      # datetime of the first reading, i.e., datetime(2024, 8, 1). Shown as the frame title.
+TIMELAPSE_INTERVAL = 5      # Minutes between readings.
+TIMELAPSE_ROTATE = False    # Rotate the camera while playing.
+TIMELAPSE_FPS = 12
+TIMELAPSE_MAX_PILLOW_FRAMES = 500  # Frame cap when a GIF has to be built in memory (no ffmpeg).
+TIMELAPSE_OUTPUT = '/Users/Dave/Temp/timelapse.gif'  # .gif (Pillow) or .mp4 (ffmpeg)
+
+try:
+    metrics.mark("render")
+    if TIMELAPSE_FILE:
+        render_timelapse()
+    else:
+        # plt.show()
+        # The image is only rewritten when it differs from the current one (see `output_writer.py`).
+        buffer = BytesIO()
+        plt.savefig(buffer, format='png')
+        metrics.mark("write")
+        write_output('/Users/Dave/Temp/Figure 1 Planar.png', buffer.getvalue())
+finally:
+    metrics.finish()
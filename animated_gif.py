@@ -3,9 +3,39 @@
 
 """
 A script for creating animated graphics based on the ImageMagick library.
+
+By default, the script builds a single ticker (`bar_animation.gif`) from `text_list` below. To build many tickers in
+one pass, point `BATCH_CONFIG` at a JSON file that lists them. Each entry may override any of the keys in
+`TICKER_DEFAULTS`, and `text_list` items may be literal values or references to Indigo objects:
+
+    [
+        {
+            "output": "upstairs.gif",
+            "background": "bar.png",
+            "delay": 300,
+            "text_list": [
+                {"device": 12345678, "state": "temperatureInput1", "format": "Upstairs Thermostat: {}°"},
+                {"variable": 87654321, "format": "Up Time: {}"},
+                "Some literal text"
+            ]
+        }
+    ]
+
+Relative `output` and `background` paths are resolved against the images folder. All tickers are rendered in one
+invocation; each ticker is a single ImageMagick call (the background is read once and reused for every frame) and the
+calls run in parallel. A ticker whose frames, background and settings are unchanged since the last run is skipped.
+Animations are written through `output_writer.py`, which must be importable (see that module for details).
 """
 
+import hashlib
+import json
+import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import indigo_snapshot
+from output_writer import write_output
+from script_metrics import ScriptMetrics
 
 try:
     import indigo  # noqa
@@ -25,30 +55,196 @@ text_list = [
     1.23,
 ]
 
-# First part of the output command string
-OUTPUT_CMD = "magick -delay 300 -size 200x27 "
-
-# Iterate through the items in the text list
-for num in range(1, len(text_list) + 1):
-    # Build each frame image - NOTE: Added quotes around file paths
-    cmd = (
-        f'magick "{work_fldr}bar.png" -font arial -fill black -pointsize 12 '
-        f'-annotate +10+17 "{text_list[num - 1]}" "{work_fldr}bar_frame{num}.gif"'
-    )
-
-    with subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-    ) as proc:
-        indigo.server.log(f"{proc.communicate()}")
-
-    # Add command to the output command string for the new frame image
-    OUTPUT_CMD += f'-page +0+0 "{work_fldr}bar_frame{num}.gif" '
-
-# The last part of the output command string
-OUTPUT_CMD += f'-loop 0 "{work_fldr}bar_animation.gif"'
-
-# Build the animation.
-with subprocess.Popen(
-    OUTPUT_CMD, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-) as proc1:
-    indigo.server.log(f"{proc1.communicate()}")
+# Batch mode. Set to the path of a JSON ticker list (see above) or leave as None for the single ticker above.
+BATCH_CONFIG = None
+
+# Settings used by every ticker unless the ticker overrides them.
+TICKER_DEFAULTS = {
+    "background": "bar.png",
+    "delay": 300,
+    "fill": "black",
+    "font": "arial",
+    "offset": "+10+17",
+    "output": "bar_animation.gif",
+    "pointsize": 12,
+    "size": "200x27",
+}
+
+# Number of tickers encoded at the same time.
+MAX_WORKERS = 4
+
+# Seconds a single ticker may take to render before it's abandoned.
+RENDER_TIMEOUT = 30
+
+# Fingerprints of the last rendered version of each ticker, used to skip unchanged tickers. Kept in the logs folder so
+# the web server doesn't publish it.
+STATE_FILE = indigo.server.getInstallFolderPath() + "/logs/animated_gif_state.json"
+
+# Background fingerprints, computed once per run for every ticker that uses the same background. (Only the fingerprint
+# is shared; each ticker's ImageMagick call reads its background once.)
+_background_cache = {}
+
+
+# =============================================================================
+def background_fingerprint(path: str) -> str:
+    """Return a cheap fingerprint (size and mtime) of a background image, computed once per run."""
+    if path not in _background_cache:
+        try:
+            stat = os.stat(path)
+            _background_cache[path] = f"{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            _background_cache[path] = "missing"
+    return _background_cache[path]
+
+
+# =============================================================================
+def resolve_path(path: str) -> str:
+    """Resolve a ticker path against the images folder."""
+    return path if os.path.isabs(path) else f"{work_fldr}{path}"
+
+
+# =============================================================================
+def resolve_text(item) -> str:
+    """Turn a `text_list` entry into frame text. Dict entries reference an Indigo device state or variable."""
+    if not isinstance(item, dict):
+        return str(item)
+
+    if "device" in item:
+        value = indigo_snapshot.device_states(item["device"])[item["state"]]
+    elif "variable" in item:
+        value = indigo_snapshot.variable_value(item["variable"])
+    else:
+        value = item.get("text", "")
+
+    return item.get("format", "{}").format(value)
+
+
+# =============================================================================
+def escape_text(text: str) -> str:
+    """Escape ImageMagick's special annotate characters so values are drawn literally."""
+    text = text.replace("%", "%%")
+    if text.startswith("@"):
+        text = "\\" + text
+    return text
+
+
+# =============================================================================
+def build_command(ticker: dict, frames: list) -> list:
+    """
+    Build one ImageMagick command that renders every frame of a ticker and assembles the animation.
+
+    The background is read once into a memory register (`mpr:base`) and cloned for each frame, so no intermediate
+    frame files are written. The animation is sent to stdout so it can be handed to `write_output()`.
+    """
+    cmd = [
+        "magick", "-delay", str(ticker["delay"]), "-size", ticker["size"],
+        resolve_path(ticker["background"]), "-write", "mpr:base", "+delete",
+    ]
+    for text in frames:
+        cmd += [
+            "(", "mpr:base", "-font", ticker["font"], "-fill", ticker["fill"],
+            "-pointsize", str(ticker["pointsize"]), "-annotate", ticker["offset"], escape_text(text), ")",
+        ]
+    cmd += ["+repage", "-loop", "0", "gif:-"]
+    return cmd
+
+
+# =============================================================================
+def render(cmd: list, metrics: ScriptMetrics):
+    """
+    Run one ImageMagick command and return the exit code, the animation and stderr. A command that can't be started or
+    doesn't finish within `RENDER_TIMEOUT` is reported as a failure (exit code -1) instead of raising.
+    """
+    try:
+        proc = metrics.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False, timeout=RENDER_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return -1, b"", f"timed out after {RENDER_TIMEOUT} seconds"
+    except OSError as err:
+        return -1, b"", str(err)
+    return proc.returncode, proc.stdout, proc.stderr.decode("utf-8", errors="replace").strip()
+
+
+# =============================================================================
+def load_tickers() -> list:
+    """Load the ticker list (batch mode) or build the single default ticker."""
+    if BATCH_CONFIG is None:
+        entries = [{"text_list": text_list}]
+    else:
+        with open(BATCH_CONFIG, "r", encoding="utf-8") as infile:
+            entries = json.load(infile)
+
+    return [{**TICKER_DEFAULTS, **entry} for entry in entries]
+
+
+# =============================================================================
+def load_state() -> dict:
+    """Load the fingerprints saved by the previous run."""
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+
+# =============================================================================
+def save_state(state: dict):
+    """Save ticker fingerprints for the next run."""
+    write_output(STATE_FILE, json.dumps(state, indent=2, sort_keys=True), sidecar=False)
+
+
+# =============================================================================
+def main(metrics: ScriptMetrics):
+    """Render every ticker whose frames changed since the last run."""
+    metrics.mark("collect")
+    state = load_state()
+    pending = {}
+    tickers = load_tickers()
+    metrics.count("tickers", len(tickers))
+
+    # Indigo lookups happen here, in the main thread; only the encoding is parallel.
+    for ticker in tickers:
+        output = resolve_path(ticker["output"])
+        try:
+            frames = [resolve_text(item) for item in ticker["text_list"]]
+        except (KeyError, ValueError) as err:
+            indigo.server.log(f"Unable to read values for {ticker['output']}: {err}", isError=True)
+            continue
+
+        cmd = build_command(ticker, frames)
+        fingerprint = hashlib.sha256(
+            json.dumps([cmd, background_fingerprint(resolve_path(ticker["background"]))]).encode("utf-8")
+        ).hexdigest()
+
+        if state.get(output) == fingerprint and os.path.isfile(output):
+            continue
+        pending[output] = (cmd, fingerprint)
+
+    metrics.count("tickers_rendered", len(pending))
+    if not pending:
+        return
+
+    metrics.mark("render")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = {output: executor.submit(render, cmd, metrics) for output, (cmd, _) in pending.items()}
+
+    metrics.mark("write")
+    for output, future in results.items():
+        try:
+            returncode, animation, stderr = future.result()
+            if returncode == 0:
+                write_output(output, animation)
+                state[output] = pending[output][1]
+                continue
+        except Exception as err:  # noqa
+            stderr = repr(err)
+        state.pop(output, None)
+        indigo.server.log(f"Unable to build {output}: {stderr}", isError=True)
+
+    save_state(state)
+
+
+script_metrics = ScriptMetrics("animated_gif")
+try:
+    main(script_metrics)
+finally:
+    script_metrics.finish()
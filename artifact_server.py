@@ -0,0 +1,263 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A small HTTP server for the files generated by the scripts in this repository (ICS feeds, charts, GIFs and reports).
+
+Files are served from an in-memory cache. Every request checks the file's size and modification time (a `stat()`, not
+a read), so a new version published by a script is picked up on the next request. Responses carry `ETag` and
+`Last-Modified` headers and conditional requests (`If-None-Match` / `If-Modified-Since`) are answered with `304 Not
+Modified`, so calendar clients and dashboards that poll every few minutes only download a file when it has changed.
+Text formats (ICS, reports, etc.) are sent gzip-compressed to clients that accept it.
+
+When a file was written by `output_writer.py`, the ETag is taken from its sidecar; otherwise it's computed from the
+file content when the file is loaded.
+
+Recently served files are kept in memory up to `CACHE_BYTES` (least recently used files are dropped first; files
+larger than `MAX_CACHED_FILE` are served from disk each time), and files that disappear are dropped from the cache.
+
+By default the server only listens on this Mac (`127.0.0.1`) and there's no authentication. To serve other machines
+on your network, set `HOST = "0.0.0.0"` and add their network to `ALLOWED_NETWORKS` (e.g., `"192.168.1.0/24"`);
+requests from anywhere else are refused. Don't expose the port to the internet.
+
+Run the script from a terminal (`python3 artifact_server.py`) or from an Indigo schedule/startup trigger. Then point
+subscriptions at the server instead of the reflector folder, i.e., `http://127.0.0.1:8177/public/davecal.ics`. Plugin
+reference reports (`plugin_reference_report.py` with `_print_to_file`) are served under `/reports/`.
+"""
+
+import gzip
+import hashlib
+import ipaddress
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from fnmatch import fnmatch
+from stat import S_ISREG
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import indigo  # noqa
+    INDIGO_FOLDER = indigo.server.getInstallFolderPath()
+except ImportError:
+    INDIGO_FOLDER = "/Library/Application Support/Perceptive Automation/Indigo 2023.2"  # TODO: Indigo install folder
+
+from output_writer import SIDECAR_SUFFIX, read_sidecar, sidecar_matches
+
+HOST = "127.0.0.1"
+PORT = 8177
+
+# Client addresses allowed to connect (see above before widening `HOST`).
+ALLOWED_NETWORKS = ["127.0.0.0/8", "::1/128"]
+
+# URL prefix -> (folder served under that prefix, file name pattern). The logs folder holds more than the reports, so
+# only the report files are served from it.
+ROOTS = {
+    "/public/": (f"{INDIGO_FOLDER}/Web Assets/public/", "*"),
+    "/static/": (f"{INDIGO_FOLDER}/Web Assets/images/controls/static/", "*"),
+    "/reports/": (f"{INDIGO_FOLDER}/logs/", "plugin_reference_report_*.txt"),
+}
+
+# Memory used by cached files (bodies plus gzip copies), and the largest file that is cached.
+CACHE_BYTES = 64 * 1024 * 1024
+MAX_CACHED_FILE = 16 * 1024 * 1024
+
+# File types that are sent gzip-compressed to clients that accept it. Images are already compressed.
+GZIP_TYPES = {".csv", ".html", ".ics", ".json", ".txt"}
+
+mimetypes.add_type("text/calendar", ".ics")
+
+# path -> cache entry (see `load()`), least recently used first
+_cache = OrderedDict()
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+_allowed_networks = [ipaddress.ip_network(network) for network in ALLOWED_NETWORKS]
+
+
+# =============================================================================
+def allowed(address: str) -> bool:
+    """True if a client address is in one of the `ALLOWED_NETWORKS`."""
+    try:
+        client = ipaddress.ip_address(address.split("%", 1)[0])
+    except ValueError:
+        return False
+    if client.version == 6 and client.ipv4_mapped:
+        client = client.ipv4_mapped
+    return any(client in network for network in _allowed_networks)
+
+
+# =============================================================================
+def resolve(url_path: str):
+    """
+    Map a URL path to a path in one of the served folders, or None. Hidden files and sidecars aren't served. The path
+    may not exist (`load()` checks it).
+    """
+    url_path = url_path.split("?", 1)[0]
+    for prefix, (folder, pattern) in ROOTS.items():
+        if not url_path.startswith(prefix):
+            continue
+        name = url_path[len(prefix):]
+        if not name or name.startswith(".") or "/." in name or name.endswith(SIDECAR_SUFFIX):
+            return None
+        if not fnmatch(name, pattern):
+            return None
+        path = os.path.realpath(os.path.join(folder, name))
+        if path.startswith(os.path.realpath(folder) + os.sep):
+            return path
+    return None
+
+
+# =============================================================================
+def _entry_size(entry: dict) -> int:
+    """Memory held by a cache entry."""
+    return len(entry["body"]) + len(entry["gzip"] or b"")
+
+
+# =============================================================================
+def evict(path: str):
+    """Drop a file from the cache."""
+    global _cache_size
+    with _cache_lock:
+        entry = _cache.pop(path, None)
+        if entry:
+            _cache_size -= _entry_size(entry)
+
+
+# =============================================================================
+def load(path: str) -> dict:
+    """Return the cache entry for `path`, reloading it if the file changed on disk."""
+    global _cache_size
+    try:
+        stat = os.stat(path)
+        if not S_ISREG(stat.st_mode):
+            raise IsADirectoryError(path)
+    except OSError:
+        evict(path)
+        raise
+    stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry and entry["stamp"] == stamp:
+            _cache.move_to_end(path)
+            return entry
+
+    with open(path, "rb") as infile:
+        body = infile.read()
+
+    sidecar = read_sidecar(path)
+    if sidecar.get("etag") and sidecar.get("size") == len(body) and sidecar_matches(sidecar, stat):
+        etag = sidecar["etag"]
+    else:
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    extension = os.path.splitext(path)[1].lower()
+    entry = {
+        "stamp": stamp,
+        "body": body,
+        "gzip": gzip.compress(body, mtime=0) if extension in GZIP_TYPES else None,
+        "content_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+        "etag": etag,
+        "last_modified": formatdate(stat.st_mtime, usegmt=True),
+        "mtime": int(stat.st_mtime),
+    }
+    evict(path)
+    if stat.st_size <= MAX_CACHED_FILE:
+        with _cache_lock:
+            _cache[path] = entry
+            _cache_size += _entry_size(entry)
+            while _cache_size > CACHE_BYTES and len(_cache) > 1:
+                _cache_size -= _entry_size(_cache.popitem(last=False)[1])
+    return entry
+
+
+# =============================================================================
+def not_modified(headers, entry: dict, etag: str) -> bool:
+    """Evaluate the conditional request headers against a cache entry."""
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            return entry["mtime"] <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# =============================================================================
+class ArtifactHandler(BaseHTTPRequestHandler):
+    """Serve cached artifacts with conditional GET and gzip support."""
+
+    server_version = "IndigoArtifactServer/1.0"
+
+    def do_GET(self):
+        """Send the artifact (or a 304)."""
+        self.send_artifact(include_body=True)
+
+    def do_HEAD(self):
+        """Send the artifact headers only."""
+        self.send_artifact(include_body=False)
+
+    def send_artifact(self, include_body: bool):
+        """Look up the requested artifact and send it."""
+        if not allowed(self.client_address[0]):
+            self.send_error(403)
+            return
+
+        path = resolve(self.path)
+        try:
+            entry = load(path) if path else None
+        except OSError:
+            entry = None
+
+        if entry is None:
+            self.send_error(404)
+            return
+
+        # The compressed representation gets its own ETag, as its bytes differ from the file's.
+        use_gzip = entry["gzip"] is not None and "gzip" in self.headers.get("Accept-Encoding", "")
+        body, etag = (entry["gzip"], f'{entry["etag"][:-1]}-gzip"') if use_gzip else (entry["body"], entry["etag"])
+
+        if not_modified(self.headers, entry, etag):
+            self.send_response(304)
+            self.send_common_headers(entry, etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_common_headers(entry, etag)
+        self.send_header("Content-Type", entry["content_type"])
+        self.send_header("Content-Length", str(len(body)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def send_common_headers(self, entry: dict, etag: str):
+        """Headers sent with both 200 and 304 responses."""
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", entry["last_modified"])
+        self.send_header("Cache-Control", "no-cache")
+        if entry["gzip"] is not None:
+            self.send_header("Vary", "Accept-Encoding")
+
+    def log_message(self, format, *args):  # noqa
+        """Keep the Indigo event log (or terminal) quiet; clients poll often."""
+
+
+# =============================================================================
+def main():
+    """Serve until interrupted."""
+    with ThreadingHTTPServer((HOST, PORT), ArtifactHandler) as httpd:
+        httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ Simple script to notify of devices with low battery levels.
 In order for the script to function, you must replace the numbers `123` with the applicable Indigo variable IDs.
 Alternatively, you can simply set `target_level` to any integer between 0 - 100 and email address to a valid email
 string.
+
+To check several Indigo servers and send one combined digest, list them in `SITES` (see `battery_snapshots.py`).
 """
 
 try:
@@ -11,15 +13,54 @@ try:
 except ImportError:
     ...
 
-target_level = int(indigo.variables[123].value)  # 123 = Indigo variable ID or integer between 0-100
-email_address = indigo.variables[123].value  # 123 = Indigo variable ID or email string
-email_body = ""
+from battery_snapshots import gather
+import indigo_snapshot
+from script_metrics import ScriptMetrics
+
+# Leave empty to check this server only.
+SITES = []
+
+metrics = ScriptMetrics("battery_low_notify")
+try:
+    metrics.mark("collect")
+    target_level = int(indigo.variables[123].value)  # 123 = Indigo variable ID or integer between 0-100
+    email_address = indigo.variables[123].value  # 123 = Indigo variable ID or email string
+    email_body = ""
+    error_body = ""
+    low_count = 0
+
+    if SITES:
+        records, errors = gather(SITES)
+        for site in SITES:
+            low_records = [
+                record for record in records
+                if record['site'] == site['name']
+                and record['battery_level'] and record['battery_level'] <= target_level
+            ]
+            low_count += len(low_records)
+            site_lines = "".join(
+                f"    {record['name']} battery level: {record['battery_level']}\n" for record in low_records
+            )
+            if site_lines:
+                email_body += f"{site['name']}:\n{site_lines}"
+            if site['name'] in errors:
+                error_body += f"    {site['name']}: {errors[site['name']]}\n"
+    else:
+        for record in indigo_snapshot.battery_devices():
+            if record.battery_level:
+                if record.battery_level <= target_level:
+                    email_body += f"{record.name} battery level: {record.battery_level}\n"
+                    low_count += 1
 
-for dev in indigo.devices.iter():
-    if dev.batteryLevel:
-        if dev.batteryLevel <= target_level:
-            email_body += f"{dev.name} battery level: {dev.batteryLevel}\n"
+    if email_body != "" or error_body != "":
+        metrics.mark("notify")
+        subject = "Indigo Low Battery Alert" if email_body else "Indigo Battery Check Failed"
+        if email_body:
+            email_body = "The following Indigo devices have low battery levels:\n" + email_body
+        if error_body:
+            email_body += ("\n" if email_body else "") + "Unable to read battery levels from:\n" + error_body
+        indigo.server.sendEmailTo(email_address, subject=subject, body=email_body)
 
-if email_body != "":
-    email_body = "The following Indigo devices have low battery levels:\n" + email_body
-    indigo.server.sendEmailTo(email_address, subject="Indigo Low Battery Alert", body=email_body)
+    metrics.count("low_battery_devices", low_count)
+finally:
+    metrics.finish()
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Collect battery levels from one or more Indigo servers.
+
+Used by `battery_charting_script.py` and `battery_low_notify.py` to build one combined chart and one alert digest for
+several sites. Each site is either the server the script is running on (`"local": True`) or a remote Indigo server
+reached through the Indigo HTTP API (`/v2/api/indigo.devices`) with an API key. Remote sites are queried concurrently;
+each request has its own timeout, and a site that doesn't answer before the overall deadline is reported as an error
+instead of holding up the others.
+
+    SITES = [
+        {"name": "Home", "local": True},
+        {"name": "Cabin", "url": "https://cabin.indigodomo.net", "api_key": "XXXX"},
+        {"name": "Shop", "url": "http://10.0.2.10:8176", "api_key": "XXXX", "timeout": 5},
+    ]
+
+To use this module from scripts run by Indigo, save it to the `Python3-includes` folder in the Indigo support folder.
+"""
+
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    import indigo_snapshot
+except ImportError:
+    indigo_snapshot = None  # not running under Indigo; only remote sites can be used
+
+# Default per-request timeout (seconds) and overall deadline for all sites.
+DEFAULT_TIMEOUT = 10
+DEADLINE = 20
+
+API_PATH = "/v2/api/indigo.devices"
+
+
+# =============================================================================
+def local_snapshot(site: dict) -> list:
+    """Battery levels of the devices on the server the script is running on."""
+    return [
+        {"site": site["name"], "name": record.name, "battery_level": record.battery_level}
+        for record in indigo_snapshot.battery_devices()
+    ]
+
+
+# =============================================================================
+def remote_snapshot(site: dict) -> list:
+    """Battery levels of the devices on a remote Indigo server."""
+    request = urllib.request.Request(
+        site["url"].rstrip("/") + API_PATH,
+        headers={"Authorization": f"Bearer {site.get('api_key', '')}", "Accept": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=site.get("timeout", DEFAULT_TIMEOUT)) as response:
+        devices = json.load(response)
+
+    records = []
+    for dev in devices:
+        level = dev.get("batteryLevel")
+        if level is None:
+            level = dev.get("states", {}).get("batteryLevel")
+        if level is not None:
+            records.append({"site": site["name"], "name": dev.get("name", str(dev.get("id"))), "battery_level": level})
+    return records
+
+
+# =============================================================================
+def gather(sites: list, deadline: float = DEADLINE):
+    """
+    Collect battery snapshots from all sites concurrently.
+
+    :param sites: site definitions (see module docstring).
+    :param deadline: seconds to wait for all sites before giving up on the slow ones.
+    :return: (records, errors) where records is a list of site-tagged dicts and errors maps site name to a message.
+    """
+    records = []
+    errors = {}
+    if not sites:
+        return records, errors
+
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(sites))
+    # Start every remote request before reading the local site, so they run while it's read.
+    futures = {
+        executor.submit(remote_snapshot, site): site["name"] for site in sites if not site.get("local")
+    }
+    for site in sites:
+        if site.get("local"):
+            # Indigo object access stays on the calling thread.
+            try:
+                records += local_snapshot(site)
+            except Exception as err:  # noqa
+                errors[site["name"]] = str(err)
+
+    # The deadline covers the local read too.
+    done, not_done = wait(futures, timeout=max(0.0, deadline - (time.monotonic() - started)))
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in done:
+        try:
+            records += future.result()
+        except Exception as err:  # noqa
+            errors[futures[future]] = str(err)
+    for future in not_done:
+        errors[futures[future]] = f"no response within {deadline} seconds"
+
+    return records, errors
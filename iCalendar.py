@@ -13,7 +13,9 @@ forecast information on your calendar that will automatically refresh as new dat
 becomes dated. In this case, a calendar subscription may be best.
 
 Instructions:
-- Modify the below script to suit your needs. The events below are placeholders.
+- Modify the below script to suit your needs. The events below are placeholders. Add or remove entries in `SOURCES`
+  to combine several data sources in one feed, and set `HORIZON_DAYS` to control how far ahead events are published.
+  Events are streamed to the file as they're generated, so large feeds don't need to be assembled in memory.
 - Run the script and make sure to save the ICS file to a location that is a web server. You can run it from an Indigo
   schedule, trigger or outside Indigo.
 - Subscribe to the resulting ICS file in Calendar.app. In Calendar:
@@ -38,53 +40,193 @@ Subscribe to Calendars https://support.apple.com/guide/calenda ... cl1022/mac
 """
 
 
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
+from hashlib import sha1
+from itertools import islice
 import indigo  # noqa
+import indigo_snapshot
+from output_writer import write_output
+from script_metrics import ScriptMetrics
 
-# A valid web server location and a data source object
+# A valid web server location
 ICS_FILE_LOC = f"{indigo.server.getInstallFolderPath()}/Web Assets/public/davecal.ics"
-WEATHER_DEV  = indigo.devices[1655952153]
 
-# Calendar-wide properties
-payload = """
-BEGIN:VCALENDAR
-CALSCALE:GREGORIAN
-VERSION:2.0
-
-"""
-
-# Individual events
-for nnn in range(0, 5):
-    date     = WEATHER_DEV.states[f'daily_{nnn}_dt']  # timestamp
-    date_fmt = datetime.fromtimestamp(date).strftime('%Y%m%d')  # "20240827"
-    low      = WEATHER_DEV.states[f'daily_{nnn}_temp_min']  # float
-    high     = WEATHER_DEV.states[f'daily_{nnn}_temp_max']  # float
-    summary  = WEATHER_DEV.states[f'daily_{nnn}_summary']  # string
-
-    payload += f"""BEGIN:VEVENT
-DTSTART;VALUE=DATE:{date_fmt}
-SUMMARY:{low:0.0f}º / {high:0.0f}º
-DESCRIPTION:{summary}
-END:VEVENT
-
-"""
-
-# End of calendar
-payload += "END:VCALENDAR"
-
-# Write ICS file to server location
-with open(ICS_FILE_LOC, "w", encoding='utf-8') as outfile:
-    outfile.write(payload)
-
-# indigo.server.log(payload)
-
-# Sample output format
+# How far ahead events are published, and a cap on the size of the feed.
+HORIZON_DAYS = 30
+MAX_EVENTS   = 5000
+
+# Domain used to build event UIDs. UIDs are stable across runs, so calendar clients update events instead of
+# replacing them.
+UID_DOMAIN = "indigo.local"
+
+# Data sources. Each entry names a source type (see `SOURCE_TYPES` below) and its settings.
+# - forecast:  `daily_{n}_*` states of a weather device (one all-day event per day).
+# - battery:   projected battery replacement dates for all battery devices, assuming a linear drain of
+#              `drain_per_day` percent per day until the level reaches `threshold`.
+# - schedules: the next run of each enabled Indigo schedule.
+SOURCES = [
+    {"type": "forecast", "device": 1655952153},
+    # {"type": "battery", "threshold": 10, "drain_per_day": 0.1},
+    # {"type": "schedules"},
+]
+
+# Stamp shared by every event in this run. It only changes daily, so an unchanged feed renders to identical bytes and
+# isn't rewritten.
+DTSTAMP = datetime.now(timezone.utc).strftime('%Y%m%dT000000Z')
+
+
+# =============================================================================
+def escape_text(value) -> str:
+    """Escape an iCalendar TEXT value (RFC 5545 3.3.11)."""
+    return (str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+# =============================================================================
+def fold(line: str) -> str:
+    """Fold a content line to 75 octets and terminate it with CRLF (RFC 5545 3.1)."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+
+    parts = []
+    start = 0
+    limit = 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Don't split a multibyte UTF-8 character.
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode("utf-8"))
+        start = end
+        limit = 74  # continuation lines start with a space
+    return "\r\n ".join(parts) + "\r\n"
+
+
+# =============================================================================
+def make_uid(*parts) -> str:
+    """Build a stable UID from the parts that identify an event."""
+    return f"{sha1('/'.join(str(part) for part in parts).encode('utf-8')).hexdigest()}@{UID_DOMAIN}"
+
+
+# =============================================================================
+def forecast_events(source: dict, start: date, end: date):
+    """Yield one all-day event per forecast day. The device's states are read once."""
+    states = indigo_snapshot.device_states(source["device"])
+    nnn = 0
+    while f'daily_{nnn}_dt' in states:
+        day = datetime.fromtimestamp(states[f'daily_{nnn}_dt']).date()
+        if start <= day < end:
+            yield {
+                "uid": make_uid("forecast", source["device"], day),
+                "start": day,
+                "summary": f"{states[f'daily_{nnn}_temp_min']:0.0f}º / {states[f'daily_{nnn}_temp_max']:0.0f}º",
+                "description": states[f'daily_{nnn}_summary'],
+            }
+        nnn += 1
+
+
+# =============================================================================
+def battery_events(source: dict, start: date, end: date):
+    """Yield a projected replacement date for each battery device that will reach the threshold within the horizon."""
+    threshold = source.get("threshold", 10)
+    drain = source.get("drain_per_day", 0.1)
+    if drain <= 0:
+        return
+    for record in indigo_snapshot.battery_devices():
+        level = record.battery_level
+        day = start + timedelta(days=max(0.0, (float(level) - threshold) / drain))
+        if day < end:
+            yield {
+                "uid": make_uid("battery", record.id),
+                "start": day,
+                "summary": f"Replace battery: {record.name}",
+                "description": f"Battery level {level}% (threshold {threshold}%)",
+            }
+
+
+# =============================================================================
+def schedule_events(source: dict, start: date, end: date):
+    """Yield the next run of each enabled schedule within the horizon."""
+    for sched in indigo.schedules.iter():
+        next_run = getattr(sched, "nextExecution", None)
+        if not sched.enabled or not next_run or not start <= next_run.date() < end:
+            continue
+        yield {
+            "uid": make_uid("schedule", sched.id, next_run.isoformat()),
+            "start": next_run,
+            "summary": sched.name,
+            "description": f"Indigo schedule {sched.id}",
+        }
+
+
+SOURCE_TYPES = {
+    "battery": battery_events,
+    "forecast": forecast_events,
+    "schedules": schedule_events,
+}
+
+
+# =============================================================================
+def collect_events():
+    """Yield events from every source, in source order, up to `MAX_EVENTS`."""
+    start = date.today()
+    end = start + timedelta(days=HORIZON_DAYS)
+
+    def _all():
+        for source in SOURCES:
+            try:
+                yield from SOURCE_TYPES[source["type"]](source, start, end)
+            except (KeyError, TypeError, ValueError) as err:
+                indigo.server.log(f"Skipping calendar source {source}: {err}", isError=True)
+
+    return islice(_all(), MAX_EVENTS)
+
+
+# =============================================================================
+def generate_calendar(events):
+    """Yield the calendar as folded content lines. Events are consumed one at a time."""
+    for line in ("BEGIN:VCALENDAR", "PRODID:-//Indigo//iCalendar.py//EN", "VERSION:2.0", "CALSCALE:GREGORIAN"):
+        yield fold(line)
+
+    for count, event in enumerate(events, start=1):
+        metrics.count("events", count)
+        if isinstance(event["start"], datetime):
+            dtstart = f"DTSTART:{event['start']:%Y%m%dT%H%M%S}"  # floating (local) time
+        else:
+            dtstart = f"DTSTART;VALUE=DATE:{event['start']:%Y%m%d}"  # "20240827"
+
+        yield "".join(fold(line) for line in (
+            "BEGIN:VEVENT",
+            f"UID:{event['uid']}",
+            f"DTSTAMP:{DTSTAMP}",
+            dtstart,
+            f"SUMMARY:{escape_text(event['summary'])}",
+            f"DESCRIPTION:{escape_text(event['description'])}",
+            "END:VEVENT",
+        ))
+
+    yield fold("END:VCALENDAR")
+
+
+# Stream the ICS file to the server location (only replaced when it changed; see `output_writer.py`). Events are
+# collected while the file is written, so this is a single phase.
+metrics = ScriptMetrics("iCalendar")
+try:
+    metrics.mark("build")
+    write_output(ICS_FILE_LOC, generate_calendar(collect_events()))
+finally:
+    metrics.finish()
+
+# Sample output format (lines end with CRLF and are folded at 75 octets)
 # """
 # BEGIN:VCALENDAR
-# CALSCALE:GREGORIAN
+# PRODID:-//Indigo//iCalendar.py//EN
 # VERSION:2.0
-#
+# CALSCALE:GREGORIAN
 # BEGIN:VEVENT
+# UID:3f1c0e5a4b8d9e2f7a6c1b0d9e8f7a6b5c4d3e2f@indigo.local
+# DTSTAMP:20240827T000000Z
 # DTSTART;VALUE=DATE:20240827
 # SUMMARY:74º / 101º
 # DESCRIPTION:Expect a day of partly cloudy with rain
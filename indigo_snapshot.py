@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A shared, in-memory snapshot of Indigo objects for the scripts in this repository.
+
+Each object list (devices, variables, triggers, schedules, action groups and control pages) is fetched from the server
+once and kept for `TTL` seconds, so scripts that run in the same process (for example, under `job_runner.py`) share
+the work instead of each iterating `indigo.devices` or calling `rawServerRequest()` again. Devices and variables are
+held as small named tuples with indexes by id, plugin id, battery presence and state key; the other lists are held as
+returned by `indigo.rawServerRequest()`.
+
+Snapshots are only used for bulk iteration (battery devices, devices by plugin or state, the raw lists behind the
+plugin reference report), where data up to `TTL` seconds old is fine. Lookups of a single object by id (`device()`,
+`device_states()`, `variable_value()`) always read the server directly: they cost one call each, and the values scripts
+act on (sensor readings, variables that triggers depend on) are never stale.
+
+Nothing in this repository subscribes to Indigo change notifications. A plugin that has called
+`indigo.devices.subscribeToChanges()` and `indigo.variables.subscribeToChanges()` can forward its callbacks to
+`device_updated()`, `device_deleted()`, `variable_updated()` and `variable_deleted()` to keep the snapshots current
+between refreshes. `invalidate()` drops a snapshot so it is fetched again on next use.
+
+To use this module from scripts run by Indigo, save it to the `Python3-includes` folder in the Indigo support folder.
+"""
+
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+import indigo  # noqa
+
+# Seconds a snapshot is used before it's fetched again.
+TTL = 60
+
+DeviceRecord = namedtuple("DeviceRecord", "id name plugin_id enabled battery_level states")
+VariableRecord = namedtuple("VariableRecord", "id name value folder_id")
+
+# Snapshot kinds kept in the form returned by `indigo.rawServerRequest()`.
+RAW_REQUESTS = {
+    "action_groups": "GetActionGroupList",
+    "control_pages": "GetControlPageList",
+    "raw_devices": "GetDeviceList",
+    "schedules": "GetEventScheduleList",
+    "triggers": "GetEventTriggerList",
+}
+
+_lock = threading.RLock()
+_snapshots = {}  # kind -> (fetched at, data)
+_indexes = {}    # index name -> index, rebuilt from the device snapshot when needed
+
+
+# =============================================================================
+def _device_record(dev) -> DeviceRecord:
+    """Copy the attributes the scripts use from an Indigo device."""
+    return DeviceRecord(dev.id, dev.name, dev.pluginId, dev.enabled, dev.batteryLevel, dict(dev.states))
+
+
+# =============================================================================
+def _variable_record(var) -> VariableRecord:
+    """Copy the attributes the scripts use from an Indigo variable."""
+    return VariableRecord(var.id, var.name, var.value, var.folderId)
+
+
+# =============================================================================
+def _fetch(kind: str):
+    """Fetch one object list from the server."""
+    if kind == "devices":
+        return {dev.id: _device_record(dev) for dev in indigo.devices.iter()}
+    if kind == "variables":
+        return {var.id: _variable_record(var) for var in indigo.variables.iter()}
+    return list(indigo.rawServerRequest(RAW_REQUESTS[kind]))
+
+
+# =============================================================================
+def _get(kind: str):
+    """Return a snapshot, fetching it if it's missing or older than `TTL`."""
+    with _lock:
+        fetched_at, data = _snapshots.get(kind, (None, None))
+        if fetched_at is None or time.monotonic() - fetched_at > TTL:
+            data = _fetch(kind)
+            _snapshots[kind] = (time.monotonic(), data)
+            if kind == "devices":
+                _indexes.clear()
+        return data
+
+
+# =============================================================================
+def _index(name: str) -> dict:
+    """Return a device index, building all of them from the current device snapshot if needed."""
+    with _lock:
+        records = _get("devices")
+        if not _indexes:
+            by_plugin = defaultdict(list)
+            by_state = defaultdict(list)
+            battery = []
+            for record in records.values():
+                by_plugin[record.plugin_id].append(record)
+                for key in record.states:
+                    by_state[key].append(record)
+                if record.battery_level is not None:
+                    battery.append(record)
+            _indexes.update({"battery": battery, "plugin": dict(by_plugin), "state": dict(by_state)})
+        return _indexes[name]
+
+
+# =============================================================================
+def invalidate(kind: str = None):
+    """Drop one snapshot (or all of them) so it's fetched again on next use."""
+    with _lock:
+        if kind is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(kind, None)
+        if kind in (None, "devices"):
+            _indexes.clear()
+
+
+# =============================================================================
+def device_updated(orig_dev, new_dev):  # noqa
+    """Change notification: replace a device in the snapshot."""
+    with _lock:
+        if "devices" in _snapshots:
+            _snapshots["devices"][1][new_dev.id] = _device_record(new_dev)
+            _indexes.clear()
+
+
+# =============================================================================
+def device_deleted(dev):
+    """Change notification: remove a device from the snapshot."""
+    with _lock:
+        if "devices" in _snapshots:
+            _snapshots["devices"][1].pop(dev.id, None)
+            _indexes.clear()
+
+
+# =============================================================================
+def variable_updated(orig_var, new_var):  # noqa
+    """Change notification: replace a variable in the snapshot."""
+    with _lock:
+        if "variables" in _snapshots:
+            _snapshots["variables"][1][new_var.id] = _variable_record(new_var)
+
+
+# =============================================================================
+def variable_deleted(var):
+    """Change notification: remove a variable from the snapshot."""
+    with _lock:
+        if "variables" in _snapshots:
+            _snapshots["variables"][1].pop(var.id, None)
+
+
+# =============================================================================
+def devices() -> list:
+    """All devices."""
+    return list(_get("devices").values())
+
+
+# =============================================================================
+def device(dev_id: int) -> DeviceRecord:
+    """One device by id, read from the server. Raises KeyError if there's no such device."""
+    return _device_record(indigo.devices[dev_id])
+
+
+# =============================================================================
+def device_states(dev_id: int):
+    """The current states of one device by id, read from the server. Raises KeyError if there's no such device."""
+    return indigo.devices[dev_id].states
+
+
+# =============================================================================
+def battery_devices() -> list:
+    """Devices that report a battery level."""
+    return _index("battery")
+
+
+# =============================================================================
+def devices_for_plugin(plugin_id: str) -> list:
+    """Devices that belong to a plugin."""
+    return _index("plugin").get(plugin_id, [])
+
+
+# =============================================================================
+def devices_with_state(key: str) -> list:
+    """Devices that have a state named `key`."""
+    return _index("state").get(key, [])
+
+
+# =============================================================================
+def variables() -> list:
+    """All variables."""
+    return list(_get("variables").values())
+
+
+# =============================================================================
+def variable_value(var_id: int) -> str:
+    """The current value of one variable by id, read from the server. Raises KeyError if there's no such variable."""
+    return indigo.variables[var_id].value
+
+
+# =============================================================================
+def raw(kind: str) -> list:
+    """One of the `RAW_REQUESTS` object lists, as returned by `indigo.rawServerRequest()`."""
+    return _get(kind)
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A long-lived runner for the scripts in this repository.
+
+Running each script from its own Indigo schedule starts a fresh interpreter every time and re-imports matplotlib and
+numpy, which costs far more CPU than most of the scripts themselves. This runner stays resident instead: heavy modules
+are imported once, and the scripts listed in `JOBS` are run on a bounded worker pool, either every `interval` seconds
+or whenever their `trigger` file is touched (for example, by an Indigo trigger action that runs `touch` on it). Scripts
+running in the same process also share `indigo_snapshot.py`, so the Indigo object lists are fetched once per TTL for
+all of them.
+
+- A job is never started while its previous run is still going (overlap protection).
+- A job that runs longer than its `timeout` is reported and abandoned. Python can't stop a running thread, so the run
+  keeps going in the background (and the job isn't started again until it ends), but it no longer counts against
+  `MAX_WORKERS`, so hung jobs can't stop the other jobs from being scheduled. Subprocesses that scripts start through
+  `ScriptMetrics.run()` are given the job's remaining time as their timeout, so a stuck command is killed instead.
+- Jobs marked `"pyplot": True` are run one at a time, as pyplot isn't thread-safe. A pyplot job waiting for another
+  one to finish doesn't take a worker.
+
+Jobs run in threads rather than forked processes because all of them share the plugin host's single connection to
+the Indigo server.
+
+Run the runner from Indigo's plugin host so that scripts can `import indigo`, for example from Terminal:
+
+    "/Library/Application Support/Perceptive Automation/Indigo 2023.2/IndigoPluginHost3.app/Contents/MacOS/IndigoPluginHost3" -x job_runner.py
+"""
+
+import os
+import runpy
+import sys
+import threading
+import time
+
+try:
+    import indigo  # noqa
+except ImportError:
+    indigo = None
+
+# Import the heavy modules once so every job starts warm.
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa
+    import mpl_toolkits.mplot3d  # noqa
+    import numpy  # noqa
+except ImportError:
+    pass
+
+# Folder holding the scripts (and the shared modules they import).
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_FOLDER not in sys.path:
+    sys.path.insert(0, SCRIPT_FOLDER)
+
+from script_metrics import finish_thread, job_timeout  # noqa: E402
+
+# Each job runs a script every `interval` seconds and/or when the modification time of its `trigger` file changes.
+JOBS = [
+    {"script": "battery_charting_script.py", "interval": 300, "timeout": 60, "pyplot": True},
+    {"script": "animated_gif.py", "interval": 120, "timeout": 60},
+    {"script": "iCalendar.py", "interval": 900, "timeout": 60},
+    {"script": "plugin_reference_report.py", "interval": 86400, "timeout": 300},
+    # {"script": "target_humidity_script.py", "trigger": "/Users/Dave/Temp/humidity.trigger", "timeout": 30},
+]
+
+# Jobs running at the same time (abandoned runs aren't counted).
+MAX_WORKERS = 3
+TICK = 1.0  # seconds between scheduling passes
+
+_pyplot_lock = threading.Lock()
+
+
+# =============================================================================
+def log(message: str, is_error: bool = False):
+    """Log to the Indigo event log, or to the terminal when Indigo isn't available."""
+    if indigo:
+        indigo.server.log(message, isError=is_error)
+    else:
+        print(message)
+
+
+# =============================================================================
+def trigger_stamp(path: str):
+    """The modification time of a trigger file, or None if it doesn't exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# =============================================================================
+def run_job(job: dict, lock: threading.Lock = None):
+    """Run one script in this process. `lock` (if any) was acquired by the scheduler and is released here."""
+    path = os.path.join(SCRIPT_FOLDER, job["script"])
+    try:
+        with job_timeout(job.get("timeout")):
+            runpy.run_path(path, run_name="__main__")
+    except SystemExit as err:
+        if err.code not in (None, 0):
+            log(f"{job['script']} exited: {err.code}", is_error=True)
+    except Exception as err:  # noqa
+        log(f"{job['script']} failed: {err!r}", is_error=True)
+    finally:
+        finish_thread()
+        if lock:
+            lock.release()
+
+
+# =============================================================================
+def main():
+    """Schedule jobs until interrupted."""
+    now = time.monotonic()
+    # One entry per job (a script may be listed more than once, e.g., on an interval and on a trigger).
+    states = [
+        {
+            "next_run": now,
+            "trigger": trigger_stamp(job["trigger"]) if job.get("trigger") else None,
+            "pending": False,
+            "thread": None,
+            "started": None,
+            "abandoned": False,
+        }
+        for job in JOBS
+    ]
+
+    try:
+        while True:
+            now = time.monotonic()
+            running = 0
+            for job, job_state in zip(JOBS, states):
+                thread = job_state["thread"]
+
+                # Still running: abandon it once it overruns, and don't start another run.
+                if thread is not None and thread.is_alive():
+                    if not job_state["abandoned"]:
+                        if now - job_state["started"] > job.get("timeout", float("inf")):
+                            log(f"{job['script']} has been running for more than {job['timeout']} seconds; "
+                                f"abandoning it.", is_error=True)
+                            job_state["abandoned"] = True
+                        else:
+                            running += 1
+                    continue
+
+                if job.get("interval") is not None and now >= job_state["next_run"]:
+                    job_state["pending"] = True
+                    job_state["next_run"] = now + job["interval"]
+                if job.get("trigger"):
+                    stamp = trigger_stamp(job["trigger"])
+                    if stamp != job_state["trigger"]:
+                        job_state["trigger"] = stamp
+                        job_state["pending"] = stamp is not None or job_state["pending"]
+
+            # Start pending jobs while there are free workers. A pyplot job whose lock is taken stays pending.
+            for job, job_state in zip(JOBS, states):
+                if running >= MAX_WORKERS:
+                    break
+                if not job_state["pending"] or (job_state["thread"] is not None and job_state["thread"].is_alive()):
+                    continue
+                lock = _pyplot_lock if job.get("pyplot") else None
+                if lock and not lock.acquire(blocking=False):
+                    continue
+                thread = threading.Thread(target=run_job, args=(job, lock), name=job["script"], daemon=True)
+                job_state.update(pending=False, thread=thread, started=now, abandoned=False)
+                thread.start()
+                running += 1
+
+            time.sleep(TICK)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
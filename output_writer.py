@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Change-aware, atomic output writer shared by the scripts that generate files for the Indigo web server.
+
+Scripts hand their rendered output to `write_output()` instead of opening the target file themselves. The output is
+hashed first: bytes and strings in memory, iterables while they're streamed to a temporary file in the target folder.
+When the hash matches the previous version, nothing is written and the target is left untouched (so web clients don't
+download it again). Otherwise, the new content is written to a temporary file that is renamed over the target--which
+is atomic, so a client never sees a partially written file--and a small JSON sidecar (`<target>.meta.json`) is written next to it with the ETag, size and modification time. Pollers and
+`artifact_server.py` can use the sidecar to answer conditional requests without reading the file.
+
+The sidecar also records the target's inode and modification time, and is only trusted while they still match the
+file (see `sidecar_matches()`). A sidecar left behind by a crash between the rename and the sidecar write describes
+the previous content, so it never causes a write to be skipped.
+
+Files nobody polls (internal state, caches, metrics, uniquely named reports) are written with `sidecar=False`: they're
+still replaced atomically, but without change detection or a sidecar.
+
+To use this module from scripts run by Indigo, save it to the `Python3-includes` folder in the Indigo support folder
+(for example, `/Library/Application Support/Perceptive Automation/Python3-includes/`).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from email.utils import formatdate
+
+SIDECAR_SUFFIX = ".meta.json"
+
+# Permissions for new files. Temporary files are created 0600, which the web server may not be able to read.
+FILE_MODE = 0o644
+
+# Callables notified of every `write_output()` call as `listener(path, size, written)` (see `script_metrics.py`).
+WRITE_LISTENERS = []
+
+
+# =============================================================================
+def sidecar_path(path: str) -> str:
+    """Return the path of the metadata sidecar for `path`."""
+    return f"{path}{SIDECAR_SUFFIX}"
+
+
+# =============================================================================
+def read_sidecar(path: str) -> dict:
+    """Return the sidecar metadata for `path`, or an empty dict if there isn't any."""
+    try:
+        with open(sidecar_path(path), "r", encoding="utf-8") as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+
+# =============================================================================
+def sidecar_matches(meta: dict, stat: os.stat_result) -> bool:
+    """Return True if sidecar metadata `meta` describes the file with the given `os.stat()` result."""
+    return (
+        meta.get("size") == stat.st_size
+        and meta.get("mtime_ns") == stat.st_mtime_ns
+        and meta.get("inode") == stat.st_ino
+    )
+
+
+# =============================================================================
+def _unchanged(path: str, sha256: str) -> bool:
+    """Return True if `path` is known (through a matching sidecar) to hold content with the given hash."""
+    meta = read_sidecar(path)
+    try:
+        return meta.get("sha256") == sha256 and sidecar_matches(meta, os.stat(path))
+    except OSError:
+        return False
+
+
+# =============================================================================
+def _chunks(data, encoding: str):
+    """Yield `data` as byte chunks. `data` may be bytes, a string or an iterable of either."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        yield bytes(data)
+    elif isinstance(data, str):
+        yield data.encode(encoding)
+    else:
+        for chunk in data:
+            yield chunk.encode(encoding) if isinstance(chunk, str) else bytes(chunk)
+
+
+# =============================================================================
+def _replace(src: str, dst: str, data: bytes = None):
+    """Atomically move `src` over `dst`, or write `data` to `dst` through a temporary file if `src` is None."""
+    if src is None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst) or ".", prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                outfile.write(data)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            _replace(tmp_path, dst)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return
+    os.chmod(src, FILE_MODE)
+    os.replace(src, dst)
+
+
+# =============================================================================
+def _notify(path: str, size: int, written: bool):
+    """Tell the write listeners about a write."""
+    for listener in list(WRITE_LISTENERS):
+        listener(path, size, written)
+
+
+# =============================================================================
+def _stream(path: str, data, encoding: str, check: bool = True) -> tuple:
+    """
+    Stream an iterable of chunks to a temporary file next to `path` while hashing it, then move it over `path` unless
+    `check` is set and the content is unchanged. Returns (sha256, size), or (None, size) if the write was skipped.
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            for chunk in _chunks(data, encoding):
+                digest.update(chunk)
+                size += len(chunk)
+                outfile.write(chunk)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+        sha256 = digest.hexdigest()
+        if check and _unchanged(path, sha256):
+            os.unlink(tmp_path)
+            _notify(path, size, False)
+            return None, size
+
+        _replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return sha256, size
+
+
+# =============================================================================
+def write_output(path: str, data, encoding: str = "utf-8", sidecar: bool = True) -> bool:
+    """
+    Write `data` to `path` atomically unless the content is unchanged.
+
+    :param path: the target file.
+    :param data: bytes, a string, or an iterable of bytes/strings (which is streamed to disk).
+    :param encoding: encoding used for strings.
+    :param sidecar: keep a metadata sidecar and skip unchanged content. When False, the file is always written.
+    :return: True if the file was written, False if the content was unchanged.
+    """
+    if isinstance(data, str):
+        data = data.encode(encoding)
+
+    if not sidecar:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            size = len(data)
+            _replace(None, path, bytes(data))
+        else:
+            _, size = _stream(path, data, encoding, check=False)
+        _notify(path, size, True)
+        return True
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        # Everything is in memory already: hash it first and only touch the disk when it changed.
+        data = bytes(data)
+        size = len(data)
+        sha256 = hashlib.sha256(data).hexdigest()
+        if _unchanged(path, sha256):
+            _notify(path, size, False)
+            return False
+        _replace(None, path, data)
+    else:
+        sha256, size = _stream(path, data, encoding)
+        if sha256 is None:
+            return False
+
+    stat = os.stat(path)
+    meta = {
+        "etag": f'"{sha256[:32]}"',
+        "inode": stat.st_ino,
+        "last_modified": formatdate(stat.st_mtime, usegmt=True),
+        "mtime": stat.st_mtime,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+        "size": size,
+    }
+    _replace(None, sidecar_path(path), json.dumps(meta, indent=2, sort_keys=True).encode("utf-8"))
+    _notify(path, size, True)
+    return True
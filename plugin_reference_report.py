@@ -11,15 +11,26 @@ TODO: Needs unit testing
 """
 from collections import defaultdict
 from datetime import datetime
+import ast
+import hashlib
 import indigo  # noqa
+import json
+import re
 import sys
+import indigo_snapshot
+from output_writer import write_output
+from script_metrics import ScriptMetrics
 
-__version__ = "0.1.21"
-_plugin_cache = {}
+__version__ = "0.1.23"
 _print_to_event_log = True
 _print_to_file = False
 _path_to_print = indigo.server.getInstallFolderPath() + "/logs/"
 
+# Embedded script analyses, keyed by a hash of the script source, are kept between runs in this file. Bump
+# `_ANALYZER_VERSION` when the analysis changes so stale entries are ignored.
+_analysis_cache_file = _path_to_print + "plugin_reference_report_cache.json"
+_ANALYZER_VERSION = 3
+
 # Initialize an inventory dictionary with default empty collections. It uses lists so there can be multiple entries for
 # a single entry. For example, a control page may reference the same plugin device multiple times for different states.
 inventory = defaultdict(
@@ -55,6 +66,17 @@ OBJ_TYPES = (
 # List of installed plugins (both enabled and disabled)
 plugin_list = indigo.server.getPluginList(includeDisabled=True)
 
+# Plugin details keyed by plugin id, built from the single `getPluginList()` call above. Plugin ids that aren't in the
+# table aren't installed.
+PLUGIN_INFO = {
+    plugin.pluginId: {
+        "name": plugin.pluginDisplayName,
+        "enabled": plugin.isEnabled(),
+        "version": plugin.pluginVersion,
+    }
+    for plugin in plugin_list
+}
+
 # Skip certain plugin id's for things like built-ins or empty plugin id fields.
 SKIP_LIST = {
     "com.flyingdiver.indigoplugin.betteremail",  # Better Email
@@ -98,7 +120,7 @@ def generate_report():
         report += f"\nNo plugins installed."
 
     for plugin_id, plugin_name, categories in sorted_plugins:
-        report += f"\n{separator}\n{plugin_name} [{plugin_id}]\n{separator}"
+        report += f"\n{separator}\n{plugin_name} [{plugin_id}]{get_plugin_status(plugin_id)}\n{separator}"
 
         # Process each category
         for category_key in CATEGORIES:
@@ -143,8 +165,9 @@ def generate_report():
         indigo.server.log(report)
 
     if _print_to_file:
-        with open(f"{_path_to_print}plugin_reference_report_{datetime.now():%Y-%m-%d_%H-%M-%S}.txt", "w", encoding="utf-8") as file:
-            file.write(report)
+        # Each report has a new name, so there's nothing to compare against (no sidecar).
+        report_path = f"{_path_to_print}plugin_reference_report_{datetime.now():%Y-%m-%d_%H-%M-%S}.txt"
+        write_output(report_path, report, sidecar=False)
         indigo.server.log("Report generated")
 
 
@@ -171,29 +194,235 @@ def get_object_name(obj):
 
 # =============================================================================
 def get_plugin_name(plugin_id: str) -> str:
-    """Get plugin display name with caching."""
-    if plugin_id not in _plugin_cache:
-        # First time seeing this plugin - look it up and store it. Indigo will handle instances where `plugin_id`
-        # refers to a plugin that doesn't exist in the current environment.
-        try:
-            plugin = indigo.server.getPlugin(plugin_id)
-            plugin_name = plugin.pluginDisplayName
-        except TypeError:
-            # This is meant to apply to things that don't have a plugin_id if we haven't already skipped them.
-            plugin_name = "- plugin not installed -"
+    """Get plugin display name from the plugin table."""
+    if plugin_id not in PLUGIN_INFO:
+        return "Plugin not Installed"
+    return PLUGIN_INFO[plugin_id]["name"]
+
+
+# =============================================================================
+def get_plugin_status(plugin_id: str) -> str:
+    """Get the plugin's version and enabled status for the report header (empty if the plugin isn't installed)."""
+    if plugin_id not in PLUGIN_INFO:
+        return ""
+    info = PLUGIN_INFO[plugin_id]
+    return f" | v{info['version']} | {'Enabled' if info['enabled'] else 'Disabled'}"
+
+
+# =============================================================================
+# Embedded script analysis
+#
+# Embedded scripts are parsed (once per distinct source, see `analyze_script()`) instead of searched for plugin id
+# substrings. This finds plugin references built through variables, `indigo.server.getPlugin()` calls and devices that
+# belong to plugins, and ignores plugin ids that only appear in comments.
+# =============================================================================
+
+# Things that look like plugin ids (reverse-DNS identifiers) inside string literals.
+PLUGIN_ID_PATTERN = re.compile(r"[A-Za-z][\w-]*(?:\.[\w-]+){2,}")
+
+# `indigo.<command namespace>.<command>(id, ...)` calls whose first argument is a device or a variable id.
+DEVICE_NAMESPACES = {"device", "dimmer", "iodevice", "relay", "sensor", "speedcontrol", "sprinkler", "thermostat"}
+VARIABLE_NAMESPACES = {"variable"}
+
+
+# =============================================================================
+def _load_analysis_cache() -> dict:
+    """Load the persistent analysis cache."""
+    try:
+        with open(_analysis_cache_file, "r", encoding="utf-8") as infile:
+            cache = json.load(infile)
+    except (OSError, ValueError):
+        return {}
+    return cache if cache.get("version") == _ANALYZER_VERSION else {}
+
+
+_analysis_cache = _load_analysis_cache().get("scripts", {})
+_analysis_cache_used = set()
+_device_plugins = {}  # device id -> plugin id, filled once per run (see `device_plugin_id()`)
+
+
+# =============================================================================
+class ScriptAnalyzer(ast.NodeVisitor):
+    """Collect plugin, device, variable and `executeAction` references from an embedded script's syntax tree."""
+
+    def __init__(self):
+        self.constants = {}  # simple `NAME = <constant>` assignments
+        self.plugin_vars = {}  # `NAME = indigo.server.getPlugin(...)` assignments
+        self.strings = set()
+        self.plugins = set()
+        self.devices = set()
+        self.variables = set()
+        self.actions = set()
+
+    def resolve(self, node):
+        """The constant value of a node (following simple name assignments), or None."""
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self.constants.get(node.id)
+        return None
+
+    def plugin_of(self, node):
+        """The plugin id a `getPlugin()` call (or a name bound to one) refers to, or None."""
+        if isinstance(node, ast.Name):
+            return self.plugin_vars.get(node.id)
+        if isinstance(node, ast.Call) and _dotted_name(node.func) == "indigo.server.getPlugin" and node.args:
+            value = self.resolve(node.args[0])
+            return value if isinstance(value, str) else None
+        return None
+
+    def visit_Assign(self, node):  # noqa
+        """Track constants and plugin objects bound to names."""
+        self.generic_visit(node)
+        value = self.resolve(node.value)
+        plugin_id = self.plugin_of(node.value)
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                if isinstance(value, (str, int)) and not isinstance(value, bool):
+                    self.constants[target.id] = value
+                if plugin_id:
+                    self.plugin_vars[target.id] = plugin_id
+
+    def visit_Constant(self, node):  # noqa
+        """Collect plugin-id-like tokens from string literals."""
+        if isinstance(node.value, str):
+            self.strings.update(PLUGIN_ID_PATTERN.findall(node.value))
+
+    def visit_Subscript(self, node):  # noqa
+        """`indigo.devices[id]` and `indigo.variables[id]`."""
+        self.generic_visit(node)
+        collection = _dotted_name(node.value)
+        key = self.resolve(node.slice)
+        if isinstance(key, int) and not isinstance(key, bool):
+            if collection == "indigo.devices":
+                self.devices.add(key)
+            elif collection == "indigo.variables":
+                self.variables.add(key)
+
+    def visit_Call(self, node):  # noqa
+        """`getPlugin()`, `executeAction()` and `indigo.<namespace>.<command>(id)` calls."""
+        self.generic_visit(node)
+        plugin_id = self.plugin_of(node)
+        if plugin_id:
+            self.plugins.add(plugin_id)
+
+        if isinstance(node.func, ast.Attribute) and node.func.attr == "executeAction":
+            plugin_id = self.plugin_of(node.func.value)
+            action_id = self.resolve(node.args[0]) if node.args else None
+            if plugin_id:
+                self.plugins.add(plugin_id)
+                self.actions.add((plugin_id, action_id if isinstance(action_id, str) else ""))
+
+        parts = _dotted_name(node.func).split(".")
+        if len(parts) == 3 and parts[0] == "indigo" and node.args:
+            target = self.resolve(node.args[0])
+            if isinstance(target, int) and not isinstance(target, bool):
+                if parts[1] in DEVICE_NAMESPACES:
+                    self.devices.add(target)
+                elif parts[1] in VARIABLE_NAMESPACES:
+                    self.variables.add(target)
+
+        for keyword in node.keywords:
+            value = self.resolve(keyword.value)
+            if keyword.arg == "deviceId" and isinstance(value, int) and not isinstance(value, bool):
+                self.devices.add(value)
 
-        # This looks duplicative of the next `if`, but it's not. Indigo can also return this plugin name string.
-        if plugin_name == "- plugin not installed -":
-            plugin_name = f"Plugin not Installed"
-        _plugin_cache[plugin_id] = plugin_name
 
-    return _plugin_cache[plugin_id]
+# =============================================================================
+def _dotted_name(node) -> str:
+    """`indigo.server.getPlugin` for the corresponding attribute chain, or an empty string."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+        return ".".join(reversed(parts))
+    return ""
+
+
+# =============================================================================
+def analyze_script(source: str) -> dict:
+    """
+    Analyze an embedded script, using the cached result when the same source has been analyzed before.
+
+    Scripts that can't be parsed (i.e., legacy Python 2 scripts) fall back to collecting plugin-id-like tokens from the
+    raw source.
+    """
+    key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    _analysis_cache_used.add(key)
+    if key in _analysis_cache:
+        return _analysis_cache[key]
+
+    try:
+        analyzer = ScriptAnalyzer()
+        analyzer.visit(ast.parse(source))
+        result = {
+            "parsed": True,
+            "strings": sorted(analyzer.strings),
+            "plugins": sorted(analyzer.plugins),
+            "devices": sorted(analyzer.devices),
+            "variables": sorted(analyzer.variables),
+            "actions": sorted(list(action) for action in analyzer.actions),
+        }
+    except (SyntaxError, ValueError):
+        result = {
+            "parsed": False,
+            "strings": sorted(set(PLUGIN_ID_PATTERN.findall(source))),
+            "plugins": [], "devices": [], "variables": [], "actions": [],
+        }
+
+    _analysis_cache[key] = result
+    return result
+
+
+# =============================================================================
+def device_plugin_id(dev_id: int):
+    """The plugin id of a device, or None if there's no such device (from the device list, read once per run)."""
+    if not _device_plugins:
+        _device_plugins.update((dev["ID"], dev.get("PluginID", "")) for dev in indigo_snapshot.raw("raw_devices"))
+    return _device_plugins.get(dev_id)
+
+
+# =============================================================================
+def script_plugin_refs(source: str, description: str) -> list:
+    """
+    Plugin ids referenced by an embedded script, directly or through the plugin devices it uses, each with an inventory
+    description: `description`, followed by the plugin actions the script runs with `executeAction()` and the variables
+    it uses (if any).
+    """
+    analysis = analyze_script(source)
+    plugin_ids = {plugin_id for plugin_id in analysis["strings"] if plugin_id in PLUGIN_INFO}
+    plugin_ids.update(analysis["plugins"])
+    plugin_ids.update(device_plugin_id(dev_id) for dev_id in analysis["devices"])
+    plugin_ids.discard(None)
+
+    refs = []
+    for plugin_id in sorted(plugin_ids):
+        if plugin_id in SKIP_LIST:
+            continue
+        details = []
+        actions = [action_id or "?" for action_plugin, action_id in analysis["actions"] if action_plugin == plugin_id]
+        if actions:
+            details.append(f"executeAction: {', '.join(actions)}")
+        if analysis["variables"]:
+            details.append(f"variables: {', '.join(str(var_id) for var_id in analysis['variables'])}")
+        refs.append((plugin_id, f"{description} ({'; '.join(details)})" if details else description))
+    return refs
+
+
+# =============================================================================
+def save_analysis_cache():
+    """Save the analyses of the scripts seen in this run (entries for scripts that no longer exist are dropped)."""
+    scripts = {key: _analysis_cache[key] for key in sorted(_analysis_cache_used)}
+    cache = json.dumps({"version": _ANALYZER_VERSION, "scripts": scripts})
+    write_output(_analysis_cache_file, cache, sidecar=False)
 
 
 # =============================================================================
 def action_groups():
     """List action groups that reference plugin objects."""
-    for action_group in indigo.rawServerRequest("GetActionGroupList"):
+    for action_group in indigo_snapshot.raw("action_groups"):
         for action in action_group['ActionSteps']:
             if action.get('PluginID', None) not in SKIP_LIST:
                 add_to_inventory(action["PluginID"], "action_groups", {'id': action_group["ID"]})
@@ -209,17 +438,14 @@ def action_groups():
             # Search for embedded scripts with plugin references (saved as actions). Will match one or more plugin
             # references in the target script.
             elif (action.get("Class", None) == 101) and (action.get("ScriptType", None) == 0):
-                for plugin in plugin_list:
-                    plugin_id = plugin.pluginId  # Single attribute lookup
-                    if plugin_id in action["ScriptSource"] and plugin_id not in SKIP_LIST:
-                        add_to_inventory(plugin.pluginId, "action_groups", {
-                            'id': action_group["ID"], "description": f"embedded script"})
+                for plugin_id, description in script_plugin_refs(action["ScriptSource"], "embedded script"):
+                    add_to_inventory(plugin_id, "action_groups", {'id': action_group["ID"], "description": description})
 
 
 # =============================================================================
 def control_pages():
     """List the control pages that reference plugin objects"""
-    for control_page in indigo.rawServerRequest("GetControlPageList"):
+    for control_page in indigo_snapshot.raw("control_pages"):
         # Users do not need to see the internal page references.
         if control_page['Name'] == "_internal_devices_":
             continue
@@ -233,11 +459,10 @@ def control_pages():
                 # Search for embedded scripts with plugin references (saved as control page actions). Will match one or
                 # more plugin references in the target script.
                 elif (ag.get("Class", None) == 101) and (ag.get("ScriptType", None) == 0):
-                    for plugin in plugin_list:
-                        plugin_id = plugin.pluginId  # Single attribute lookup
-                        if plugin_id in ag["ScriptSource"] and plugin_id not in SKIP_LIST:
-                            add_to_inventory(plugin_id, "control_pages", {
-                                "id": control_page["ID"], "description": f"embedded script control Z-{action['ServerIndex']}"})
+                    refs = script_plugin_refs(ag["ScriptSource"], f"embedded script control Z-{action['ServerIndex']}")
+                    for plugin_id, description in refs:
+                        add_to_inventory(plugin_id, "control_pages", {
+                            "id": control_page["ID"], "description": description})
 
             # Get plugin devices and triggers that are referenced by built-in controls. For example,
             # Client Action -> Popup Controls. These don't have a `ServerIndex` because they aren't "on the page".
@@ -270,7 +495,7 @@ def control_pages():
 # =============================================================================
 def devices():
     """List the devices of type plugin"""
-    for dev in indigo.rawServerRequest("GetDeviceList"):
+    for dev in indigo_snapshot.raw("raw_devices"):
         if dev.get("PluginID", None) not in SKIP_LIST:
             add_to_inventory(dev["PluginID"], "devices", {'id': dev["ID"]})
 
@@ -278,7 +503,7 @@ def devices():
 # =============================================================================
 def schedules():
     """List the schedules that reference plugin objects"""
-    for sched in indigo.rawServerRequest("GetEventScheduleList"):
+    for sched in indigo_snapshot.raw("schedules"):
         for action in sched["ActionGroup"]["ActionSteps"]:
             if action.get("PluginID", None) not in SKIP_LIST:
                 add_to_inventory(action["PluginID"], "schedules", {'id': sched["ID"]})
@@ -286,11 +511,8 @@ def schedules():
         # Inspect trigger conditions for plugin references
         if sched['Condition'].get("ScriptType", None) == 0 and sched['Condition'].get("ScriptSource", None):
 
-            for plugin in plugin_list:
-                plugin_id = plugin.pluginId
-                if plugin_id in sched["Condition"]["ScriptSource"] and plugin_id not in SKIP_LIST:
-                    add_to_inventory(plugin.pluginId, "schedules",
-                                     {"id": sched["ID"], "description": f"schedule condition"})
+            for plugin_id, description in script_plugin_refs(sched["Condition"]["ScriptSource"], "schedule condition"):
+                add_to_inventory(plugin_id, "schedules", {"id": sched["ID"], "description": description})
 
 
 # =============================================================================
@@ -299,7 +521,7 @@ def triggers():
     List the triggers of type plugin. Triggers can be associated with plugins and also execute plugin actions -- even
     those of other plugins.
     """
-    for trig in indigo.rawServerRequest("GetEventTriggerList"):
+    for trig in indigo_snapshot.raw("triggers"):
         # Plugin Triggers
         if trig.get("PluginID", None) not in SKIP_LIST:
             add_to_inventory(trig["PluginID"], "triggers", {'id': trig["ID"]})
@@ -313,28 +535,31 @@ def triggers():
                 # Search for embedded scripts with plugin references (saved as actions). Will match one or more plugin
                 # references in the target script.
                 elif (action.get("Class", None) == 101) and (action.get("ScriptType", None) == 0):
-
-                    for plugin in plugin_list:
-                        plugin_id = plugin.pluginId
-                        if plugin_id in action["ScriptSource"] and plugin_id not in SKIP_LIST:
-                            add_to_inventory(plugin.pluginId, "trigger_actions", {
-                                'id': trig["ID"], "description": f"embedded script"})
+                    for plugin_id, description in script_plugin_refs(action["ScriptSource"], "embedded script"):
+                        add_to_inventory(plugin_id, "trigger_actions", {'id': trig["ID"], "description": description})
 
         # Inspect trigger conditions for plugin references
         if trig['Condition'].get("ScriptType", None) == 0 and trig['Condition'].get("ScriptSource", None):
-            for plugin in plugin_list:
-                plugin_id = plugin.pluginId
-                if plugin_id in trig["Condition"]["ScriptSource"] and plugin_id not in SKIP_LIST:
-                    add_to_inventory(plugin.pluginId, "triggers",
-                                     {"id": trig["ID"], "description": f"trigger condition"})
+            for plugin_id, description in script_plugin_refs(trig["Condition"]["ScriptSource"], "trigger condition"):
+                add_to_inventory(plugin_id, "triggers", {"id": trig["ID"], "description": description})
 
 
 # Assemble the data
-action_groups()
-control_pages()
-devices()
-schedules()
-triggers()
-
-# Output the results
-generate_report()
+metrics = ScriptMetrics("plugin_reference_report")
+try:
+    metrics.mark("collect")
+    action_groups()
+    control_pages()
+    devices()
+    schedules()
+    triggers()
+
+    # Output the results
+    metrics.mark("report")
+    metrics.count("plugins", len(inventory))
+    metrics.count("references", sum(len(items) for data in inventory.values() for items in data.values()))
+    generate_report()
+    save_analysis_cache()
+    metrics.count("scripts_analyzed", len(_analysis_cache_used))
+finally:
+    metrics.finish()
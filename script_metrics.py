@@ -0,0 +1,254 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Timing and resource metrics for the scripts in this repository.
+
+A script creates one `ScriptMetrics` object, marks its phases as it goes and calls `finish()` at the end:
+
+    metrics = ScriptMetrics("battery_charting_script")
+    metrics.mark("collect")
+    ...
+    metrics.mark("render")
+    ...
+    metrics.count("devices", len(device_dict))
+    metrics.finish()
+
+Each run records wall time per phase, total wall time, CPU time of the running thread, CPU time of child processes,
+peak RSS, time spent in subprocesses started with `metrics.run()`, bytes written through `output_writer.py` (and how
+many of those writes were skipped because nothing changed), and any counts the script adds. Runs are appended to a
+JSON Lines file (`script_metrics.jsonl`) and/or written as a Prometheus text file per script (`<script>.prom`, for the
+node_exporter textfile collector) in `METRICS_FOLDER`.
+
+Call `finish()` in a `finally:` block so failed runs are recorded too and the write listener is removed. Scripts run by
+`job_runner.py` are also finished by the runner (`finish_thread()`) if they end without doing so. Export errors are
+logged rather than raised, so they never hide a script's own error.
+
+Peak RSS and child CPU time are process-wide: under `job_runner.py` they cover every job running in the process.
+
+To use this module from scripts run by Indigo, save it to the `Python3-includes` folder in the Indigo support folder.
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import output_writer
+
+try:
+    import indigo  # noqa
+    METRICS_FOLDER = indigo.server.getInstallFolderPath() + "/logs/metrics/"
+except ImportError:
+    indigo = None
+    METRICS_FOLDER = os.path.expanduser("~/indigo-metrics/")
+
+# Any of "jsonl" and "prometheus". Leave empty to disable the export.
+EXPORT_FORMATS = ("jsonl", "prometheus")
+
+_jsonl_lock = threading.Lock()
+
+# Runs that haven't called `finish()` yet (see `finish_thread()`).
+_unfinished = []
+_unfinished_lock = threading.Lock()
+
+# Deadline (`time.monotonic()`) of the job running on the current thread, set by `job_timeout()`.
+_job = threading.local()
+
+
+# =============================================================================
+def _peak_rss_bytes() -> int:
+    """Peak resident set size of this process. `ru_maxrss` is in bytes on macOS and in kilobytes on Linux."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# =============================================================================
+def _children_cpu() -> float:
+    """CPU time used by finished child processes."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+# =============================================================================
+@contextmanager
+def job_timeout(seconds: float = None):
+    """
+    Bound the subprocesses started through `ScriptMetrics.run()` by scripts run on this thread (see `job_runner.py`).
+    Each call gets at most the time left until `seconds` after the start of the block.
+    """
+    _job.deadline = time.monotonic() + seconds if seconds else None
+    try:
+        yield
+    finally:
+        _job.deadline = None
+
+
+# =============================================================================
+class ScriptMetrics:
+    """Collects the metrics of one script run."""
+
+    def __init__(self, script: str):
+        self.script = script
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.children_cpu_started = _children_cpu()
+        self.phases = {}
+        self.counts = {}
+        self.subprocess_seconds = 0.0
+        self.bytes_written = 0
+        self.writes = 0
+        self.writes_skipped = 0
+        self._phase = None
+        self._lock = threading.Lock()
+        self._finished = False
+        self._thread = threading.get_ident()
+        self._deadline = getattr(_job, "deadline", None)  # read here so worker threads of the script share it
+        output_writer.WRITE_LISTENERS.append(self._record_write)
+        with _unfinished_lock:
+            _unfinished.append(self)
+
+    def mark(self, phase: str):
+        """End the current phase (if any) and start a new one."""
+        now = time.perf_counter()
+        if self._phase is not None:
+            name, started = self._phase
+            self.phases[name] = self.phases.get(name, 0.0) + now - started
+        self._phase = (phase, now) if phase else None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block as a phase."""
+        self.mark(name)
+        try:
+            yield
+        finally:
+            self.mark(None)
+
+    def count(self, name: str, value: int):
+        """Record an object count (devices charted, events written, etc.)."""
+        self.counts[name] = value
+
+    def run(self, *args, **kwargs) -> subprocess.CompletedProcess:
+        """
+        `subprocess.run()` that adds the call's wall time to the subprocess total. Safe to call from threads. Under
+        `job_timeout()`, the timeout is capped at the time the job has left.
+        """
+        if self._deadline is not None:
+            remaining = max(0.0, self._deadline - time.monotonic())
+            kwargs["timeout"] = min(kwargs.get("timeout") or remaining, remaining)
+        started = time.perf_counter()
+        try:
+            return subprocess.run(*args, **kwargs)  # noqa
+        finally:
+            with self._lock:
+                self.subprocess_seconds += time.perf_counter() - started
+
+    def _record_write(self, path: str, size: int, written: bool):  # noqa
+        """`output_writer` listener. Only writes made by the script's own thread are counted."""
+        if threading.get_ident() != self._thread:
+            return
+        with self._lock:
+            if written:
+                self.writes += 1
+                self.bytes_written += size
+            else:
+                self.writes_skipped += 1
+
+    def finish(self) -> dict:
+        """Stop collecting, export the metrics and return them."""
+        if self._finished:
+            return {}
+        self._finished = True
+        self.mark(None)
+        if self._record_write in output_writer.WRITE_LISTENERS:
+            output_writer.WRITE_LISTENERS.remove(self._record_write)
+        with _unfinished_lock:
+            if self in _unfinished:
+                _unfinished.remove(self)
+
+        record = {
+            "script": self.script,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "wall_seconds": round(time.perf_counter() - self.started, 6),
+            "cpu_seconds": round(time.thread_time() - self.cpu_started, 6),
+            "children_cpu_seconds": round(_children_cpu() - self.children_cpu_started, 6),
+            "subprocess_seconds": round(self.subprocess_seconds, 6),
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "bytes_written": self.bytes_written,
+            "writes": self.writes,
+            "writes_skipped": self.writes_skipped,
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "counts": dict(self.counts),
+        }
+
+        try:
+            if EXPORT_FORMATS:
+                os.makedirs(METRICS_FOLDER, exist_ok=True)
+            if "jsonl" in EXPORT_FORMATS:
+                jsonl_path = os.path.join(METRICS_FOLDER, "script_metrics.jsonl")
+                with _jsonl_lock, open(jsonl_path, "a", encoding="utf-8") as outfile:
+                    outfile.write(json.dumps(record, sort_keys=True) + "\n")
+            if "prometheus" in EXPORT_FORMATS:
+                prom_path = os.path.join(METRICS_FOLDER, f"{self.script}.prom")
+                output_writer.write_output(prom_path, prometheus_text(record), sidecar=False)
+        except (OSError, ValueError) as err:
+            _log_error(f"Unable to export metrics for {self.script}: {err}")
+        return record
+
+
+# =============================================================================
+def finish_thread():
+    """Finish every run started on the current thread that hasn't finished (e.g., because the script raised)."""
+    with _unfinished_lock:
+        runs = [run for run in _unfinished if run._thread == threading.get_ident()]  # noqa
+    for run in runs:
+        run.finish()
+
+
+# =============================================================================
+def _log_error(message: str):
+    """Log to the Indigo event log, or to stderr when Indigo isn't available."""
+    if indigo:
+        indigo.server.log(message, isError=True)
+    else:
+        print(message, file=sys.stderr)
+
+
+# =============================================================================
+def prometheus_text(record: dict) -> str:
+    """Format one run record in the Prometheus text exposition format."""
+    label = f'script="{record["script"]}"'
+    lines = []
+    declared = set()
+
+    def metric(name: str, value, help_text: str, extra: dict = None):
+        labels = label + "".join(f',{key}="{val}"' for key, val in (extra or {}).items())
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# HELP indigo_script_{name} {help_text}\n# TYPE indigo_script_{name} gauge\n")
+        lines.append(f"indigo_script_{name}{{{labels}}} {value}\n")
+
+    for key, help_text in (
+        ("wall_seconds", "Wall time of the last run."),
+        ("cpu_seconds", "CPU time of the last run (running thread)."),
+        ("children_cpu_seconds", "CPU time of child processes during the last run."),
+        ("subprocess_seconds", "Wall time spent in subprocesses during the last run."),
+        ("peak_rss_bytes", "Peak resident set size of the process."),
+        ("bytes_written", "Bytes written by the last run."),
+        ("writes", "Files written by the last run."),
+        ("writes_skipped", "Writes skipped by the last run because the content was unchanged."),
+    ):
+        metric(key, record[key], help_text)
+    for phase, seconds in record["phases"].items():
+        metric("phase_seconds", seconds, "Wall time per phase of the last run.", {"phase": phase})
+    for name, value in record["counts"].items():
+        metric("count", value, "Object counts of the last run.", {"name": name})
+    metric("last_run_timestamp_seconds", int(datetime.fromisoformat(record["timestamp"]).timestamp()),
+           "Time of the last run.")
+    return "".join(lines)
@@ -14,37 +14,95 @@ Temp         Humidity
 -20            15%
 
 The target humidity should never be above 45% or below 15%.
+
+Each entry in `ZONES` pairs a humidity sensor and a temperature source with the two variables the script maintains.
+A temperature source shared by several zones is read once. Variables are only written when their rounded value
+changes, so triggers on them don't fire needlessly. `HYSTERESIS` adds a dead band (in percentage points) around the
+current value so that readings hovering near a rounding boundary don't make the variables flap.
 """
 
 import indigo  # noqa
+from script_metrics import ScriptMetrics
+
+# Zones: humidity sensor device/state, temperature device/state, and the variables to update.
+ZONES = [
+    {
+        "name": "House",
+        "humidity_dev": 281604201,
+        "humidity_state": "sensorValue",
+        "temperature_dev": 1899035475,
+        "temperature_state": "temp",
+        "humidity_var": 950128135,
+        "target_var": 187913970,
+    },
+]
+
+# Dead band beyond the rounding boundary, in percentage points. 0 updates whenever the rounded value changes.
+HYSTERESIS = 0
+
+
+# =============================================================================
+def target_humidity(temperature: float) -> float:
+    """Trane target curve: 45% at +40 falling 5% per 10 degrees, bounded to 15% - 45%."""
+    return min(45.0, max(15.0, 45 - ((40 - temperature) / 2)))
+
+
+# =============================================================================
+def changed_value(raw: float, current: str):
+    """
+    Return the new (rounded) variable value, or None if the variable should keep its current value.
+
+    You can't currently compare a device state value to a variable value directly within a trigger, so the values are
+    stored as strings in variables.
+    """
+    new_value = round(raw)
+    try:
+        current_value = float(current)
+    except (TypeError, ValueError):
+        return str(new_value)
+
+    if new_value == current_value or abs(raw - current_value) < 0.5 + HYSTERESIS:
+        return None
+    return str(new_value)
+
+
+# =============================================================================
+def main(metrics: ScriptMetrics):
+    """Compute every zone's values in one pass and write only the variables that changed."""
+    metrics.mark("compute")
+    states = {}
+    updates = {}
 
+    def state(dev_id: int, key: str):
+        if (dev_id, key) not in states:
+            states[(dev_id, key)] = float(indigo.devices[dev_id].states[key])
+        return states[(dev_id, key)]
 
-CURRENT_HUMIDITY       = indigo.devices[281604201].states["sensorValue"]
-CURRENT_TEMPERATURE    = float(indigo.devices[1899035475].states["temp"])
-CURRENT_HUMIDITY_VAR   = 950128135
-TARGET_HUMIDITY_VAR_ID = 187913970
+    for zone in ZONES:
+        try:
+            humidity = state(zone["humidity_dev"], zone["humidity_state"])
+            target = target_humidity(state(zone["temperature_dev"], zone["temperature_state"]))
+        except (KeyError, TypeError, ValueError) as err:
+            indigo.server.log(f"Unable to read values for zone {zone['name']}: {err}", isError=True)
+            continue
 
-# Put the humidity level into a variable to drive the triggers.
-# =============================================================
-# You can't currently compare a device state value to a variable value directly within a trigger.
+        for var_id, raw in ((zone["humidity_var"], humidity), (zone["target_var"], target)):
+            new_value = changed_value(raw, indigo.variables[var_id].value)
+            if new_value is not None:
+                updates[var_id] = new_value
 
-CURRENT_HUMIDITY = round(CURRENT_HUMIDITY)
-CURRENT_HUMIDITY = str(CURRENT_HUMIDITY)
-indigo.variable.updateValue(CURRENT_HUMIDITY_VAR, CURRENT_HUMIDITY)
+        if zone["target_var"] in updates:
+            indigo.server.log(f"Updating {zone['name']} target humidity level to: {updates[zone['target_var']]}.")
 
-# Upper bound - not more than 45% humidity
-if CURRENT_TEMPERATURE >= 40:
-    indigo.server.log("Updating target humidity level to: 45.")
-    indigo.variable.updateValue(TARGET_HUMIDITY_VAR_ID, '45')
+    metrics.mark("write")
+    metrics.count("zones", len(ZONES))
+    metrics.count("variables_updated", len(updates))
+    for var_id, value in updates.items():
+        indigo.variable.updateValue(var_id, value)
 
-# Lower bound - not less than 15% humidity
-elif CURRENT_TEMPERATURE < -20:
-    indigo.server.log("Updating target humidity level to: 15.")
-    indigo.variable.updateValue(TARGET_HUMIDITY_VAR_ID, '15')
 
-# Temperature is between -20 and 40
-else:
-    target_humidity = 45 - ((40 - CURRENT_TEMPERATURE) / 2)
-    target_humidity = round(target_humidity)
-    indigo.server.log(f'Updating target humidity level to: {target_humidity}.')
-    indigo.variable.updateValue(TARGET_HUMIDITY_VAR_ID, target_humidity)
+script_metrics = ScriptMetrics("target_humidity_script")
+try:
+    main(script_metrics)
+finally:
+    script_metrics.finish()
@@ -30,6 +30,17 @@
 # following command:
 #
 #    `ssh USERNAME@10.0.1.123`
+#
+# How the Sync Works
+# All SSH traffic shares one multiplexed connection (ControlMaster), so only the first command pays for the SSH
+# handshake. A manifest of file names, sizes and SHA-256 checksums is read from the controller in a single command, and
+# only files that are missing locally or whose size/checksum don't match are transferred, several at a time. Each file
+# is downloaded to a hidden `.part` file (an interrupted download resumes where it stopped on the next run), verified
+# against the manifest checksum and then renamed into place. `autobackup_meta.json` is transferred last--and only if
+# every other file arrived intact--so it never refers to backups that aren't there yet.
+#
+# When `STORE_FOLDER` is set, new backups are added to the deduplicating store (`unifi_store.py`) and then deleted from
+# `LOCAL_FOLDER`, so only the store grows. Backups the store already holds (or has pruned) aren't downloaded again.
 
 # Config
 HOST="10.0.1.123"                               # TODO: Replace with your UniFi Cloud Key IP address
@@ -37,31 +48,131 @@ USER="Dave"                                     # TODO: Replace with your SSH us
 PRIVATE_KEY_PATH="/Users/Dave/.ssh/id_ed25519"  # TODO: Path to your private key (default: ~/.ssh/id_ed25519)
 BACKUP_FOLDER="/data/autobackup"                # TODO: Path to the backup directory on the Cloud Key
 LOCAL_FOLDER="/Users/Dave/Temp/unifi"           # TODO: Local directory to store backups
+PARALLEL_JOBS=4                                 # Number of files transferred at the same time
+STORE_FOLDER=""                                 # Optional: deduplicating backup store (see unifi_store.py)
+
+# Every SSH command reuses one multiplexed connection.
+CONTROL_PATH="$HOME/.ssh/cm-%C"
+export HOST USER PRIVATE_KEY_PATH BACKUP_FOLDER LOCAL_FOLDER CONTROL_PATH
+
+# Run ssh with the key and the shared connection (paths may contain spaces).
+ssh_shared() {
+    ssh -i "$PRIVATE_KEY_PATH" -o ControlMaster=auto -o "ControlPath=$CONTROL_PATH" -o ControlPersist=60 "$@"
+}
+
+# Run a command on the controller.
+remote() {
+    ssh_shared "$USER@$HOST" "$@"
+}
+
+# Quote a value for the controller's shell.
+quote() {
+    printf "'%s'" "${1//\'/\'\\\'\'}"
+}
+
+# SHA-256 of a local file (`sha256sum` on Linux, `shasum` on macOS).
+local_sha256() {
+    if command -v sha256sum > /dev/null; then
+        sha256sum "$1" | cut -d' ' -f1
+    else
+        shasum -a 256 "$1" | cut -d' ' -f1
+    fi
+}
+
+# Download one file, resuming a previous partial download, and move it into place once the checksum matches.
+fetch_file() {
+    name="$1"; size="$2"; checksum="$3"
+    part="$LOCAL_FOLDER/.$name.part"
+
+    have=0
+    [ -f "$part" ] && have=$(wc -c < "$part" | tr -d ' ')
+    if [ "$have" -gt "$size" ]; then
+        rm -f "$part"
+        have=0
+    fi
+
+    echo "Copying $BACKUP_FOLDER/$name to $LOCAL_FOLDER ($have of $size bytes already present)..."
+    if [ "$have" -lt "$size" ] && ! remote "tail -c +$((have + 1)) $(quote "$BACKUP_FOLDER/$name")" >> "$part"; then
+        echo "Failed to copy $name" >&2
+        return 1
+    fi
+
+    if [ "$(local_sha256 "$part")" != "$checksum" ]; then
+        echo "Checksum mismatch for $name; it will be copied again on the next run" >&2
+        rm -f "$part"
+        return 1
+    fi
+    mv -f "$part" "$LOCAL_FOLDER/$name"
+}
+export -f ssh_shared remote quote local_sha256 fetch_file
 
 # Ensure local backup directory exists
 mkdir -p "$LOCAL_FOLDER"
 
-# Use SCP to copy backup files from the Cloud Key to local directory
-echo "Copying files from $HOST to $LOCAL_FOLDER..."
-
-# Loop to copy files over SSH with key-based auth
-for backup_file in $(ssh -i "$PRIVATE_KEY_PATH" "$USER@$HOST" "ls $BACKUP_FOLDER"); do
-    remote_file="$BACKUP_FOLDER/$backup_file"
-    local_file="$LOCAL_FOLDER/$backup_file"
-
-    # If the file is autobackup_meta.json, replace it even if it exists. This way, the file references the most
-    # current backup file set.
-    if [ "$backup_file" == "autobackup_meta.json" ]; then
-        echo "Replacing $local_file (autobackup_meta.json)"
-        scp -i "$PRIVATE_KEY_PATH" "$USER@$HOST:$remote_file" "$LOCAL_FOLDER"
-    # Skip other files if they already exist locally
-    elif [ -f "$local_file" ]; then
-        echo "Skipping $local_file (already exists)"
-    # Copy anything not covered above
+echo "Reading the backup manifest from $HOST..."
+
+# One line per file: name, size and checksum (tab-separated)
+manifest=$(remote "cd $(quote "$BACKUP_FOLDER") && for f in *; do [ -f \"\$f\" ] || continue; printf '%s\t%s\t%s\n' \"\$f\" \"\$(wc -c < \"\$f\" | tr -d ' ')\" \"\$(sha256sum \"\$f\" | cut -d' ' -f1)\"; done") || {
+    echo "Unable to read the backup manifest from $HOST" >&2
+    exit 1
+}
+
+# Backups in the store, one "name<TAB>checksum" line each (the checksum is empty for pruned backups)
+store="$(dirname "$0")/unifi_store.py"
+stored=""
+if [ -n "$STORE_FOLDER" ]; then
+    stored=$(python3 "$store" --store "$STORE_FOLDER" known) || {
+        echo "Unable to read the backup store $STORE_FOLDER" >&2
+        exit 1
+    }
+fi
+
+# Work out which files are missing or don't match (name, size and checksum of each)
+pending=()
+meta=()
+while IFS=$'\t' read -r name size checksum; do
+    [ -z "$name" ] && continue
+    local_file="$LOCAL_FOLDER/$name"
+
+    if [ -n "$stored" ] && printf '%s\n' "$stored" | grep -qxF -e "$name"$'\t'"$checksum" -e "$name"$'\t'; then
+        echo "Skipping $name (in the backup store)"
+    elif [ -f "$local_file" ] && [ "$(wc -c < "$local_file" | tr -d ' ')" = "$size" ] \
+        && [ "$(local_sha256 "$local_file")" = "$checksum" ]; then
+        echo "Skipping $local_file (up to date)"
+    elif [ "$name" == "autobackup_meta.json" ]; then
+        meta=("$name" "$size" "$checksum")
     else
-        echo "Copying $remote_file to $LOCAL_FOLDER..."
-        scp -i "$PRIVATE_KEY_PATH" "$USER@$HOST:$remote_file" "$LOCAL_FOLDER"
+        pending+=("$name" "$size" "$checksum")
     fi
-done
+done <<< "$manifest"
+
+# Copy the backup files in parallel (NUL-separated, so names are passed through unchanged)
+status=0
+if [ "${#pending[@]}" -gt 0 ]; then
+    printf '%s\0' "${pending[@]}" | xargs -0 -n 3 -P "$PARALLEL_JOBS" bash -c 'fetch_file "$@"' _ || status=1
+fi
+
+# Copy autobackup_meta.json last, so it only references backups that are already here.
+if [ "${#meta[@]}" -gt 0 ]; then
+    if [ "$status" -eq 0 ]; then
+        fetch_file "${meta[@]}" || status=1
+    else
+        echo "Not replacing autobackup_meta.json because some backups failed to copy" >&2
+    fi
+fi
+
+# Close the shared SSH connection
+ssh_shared -O exit "$USER@$HOST" 2> /dev/null
+
+# Move new backups into the deduplicating store and apply its retention policy
+if [ -n "$STORE_FOLDER" ] && [ "$status" -eq 0 ]; then
+    python3 "$store" --store "$STORE_FOLDER" ingest "$LOCAL_FOLDER" --remove \
+        && python3 "$store" --store "$STORE_FOLDER" prune || status=1
+fi
 
-echo "Backup completed."
+if [ "$status" -eq 0 ]; then
+    echo "Backup completed."
+else
+    echo "Backup completed with errors." >&2
+fi
+exit "$status"
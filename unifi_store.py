@@ -0,0 +1,367 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A deduplicating local store for UniFi controller backups (`.unf` files) with a retention policy.
+
+`unifi_backup.sh` copies the controller's backups into a flat folder and never removes anything. This script keeps
+them in a content-addressed store instead: each backup (a "generation") is split into chunks that are stored once,
+under their SHA-256, no matter how many generations contain them. Chunks can optionally be zlib-compressed.
+
+UniFi backups are encrypted, so a change anywhere in the controller's data changes most of the file; fixed-size chunks
+are used because content-defined chunking wouldn't find more shared data in encrypted files. Identical backups (which
+the controller produces when nothing changed) are stored once.
+
+Store layout:
+    STORE/chunks/ab/abcdef...        chunk data (`.z` suffix when compressed)
+    STORE/generations/NAME.json      chunk list, size and checksum of one backup
+    STORE/ingested.txt               names of every backup ever ingested (pruned backups aren't ingested again)
+
+`unifi_backup.sh` ingests with `--remove`, which deletes each backup from its folder once the store holds it, and asks
+the store (`known`) which backups it already has, so they aren't downloaded again.
+
+Usage:
+    unifi_store.py --store STORE ingest FOLDER [--compress] [--remove]
+    unifi_store.py --store STORE known
+    unifi_store.py --store STORE list
+    unifi_store.py --store STORE prune [--daily 7] [--weekly 4] [--monthly 12] [--dry-run]
+    unifi_store.py --store STORE verify
+    unifi_store.py --store STORE restore NAME DESTINATION
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import zlib
+from datetime import datetime
+
+CHUNK_SIZE = 1024 * 1024
+
+# UniFi autobackup names end with the backup time in milliseconds, i.e.,
+# `autobackup_7.2.97_20241201_0700_1733036400000.unf`.
+TIMESTAMP_PATTERN = re.compile(r"_(\d{13})\.unf$")
+
+
+# =============================================================================
+def atomic_write(path: str, data: bytes):
+    """Write a file through a temporary file and a rename, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(data)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+# =============================================================================
+class BackupStore:
+    """A content-addressed, chunk-deduplicated backup store."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.chunk_folder = os.path.join(root, "chunks")
+        self.generation_folder = os.path.join(root, "generations")
+        self.ingested_path = os.path.join(root, "ingested.txt")
+
+    # ----------------------------------------------------------------- chunks
+    def chunk_path(self, digest: str, compressed: bool) -> str:
+        """Path of a chunk file."""
+        return os.path.join(self.chunk_folder, digest[:2], digest + (".z" if compressed else ""))
+
+    def find_chunk(self, digest: str):
+        """Path of a stored chunk (compressed or not), or None."""
+        for compressed in (False, True):
+            path = self.chunk_path(digest, compressed)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put_chunk(self, data: bytes, compress: bool) -> tuple:
+        """Store a chunk unless it's already stored. Returns (digest, bytes added to the store)."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.find_chunk(digest):
+            return digest, 0
+        payload = zlib.compress(data, 6) if compress else data
+        atomic_write(self.chunk_path(digest, compress), payload)
+        return digest, len(payload)
+
+    def read_chunk(self, digest: str) -> bytes:
+        """Read and check one chunk. Raises ValueError if it's missing or damaged."""
+        path = self.find_chunk(digest)
+        if path is None:
+            raise ValueError(f"missing chunk {digest}")
+        with open(path, "rb") as infile:
+            data = infile.read()
+        if path.endswith(".z"):
+            try:
+                data = zlib.decompress(data)
+            except zlib.error as err:
+                raise ValueError(f"damaged chunk {digest}: {err}") from err
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"damaged chunk {digest}: checksum mismatch")
+        return data
+
+    # ------------------------------------------------------------ generations
+    def generation_path(self, name: str) -> str:
+        """Path of a generation manifest."""
+        return os.path.join(self.generation_folder, f"{name}.json")
+
+    def generations(self) -> list:
+        """All generation manifests, oldest first."""
+        if not os.path.isdir(self.generation_folder):
+            return []
+        manifests = []
+        for file_name in os.listdir(self.generation_folder):
+            if file_name.endswith(".json") and not file_name.startswith("."):
+                with open(os.path.join(self.generation_folder, file_name), "r", encoding="utf-8") as infile:
+                    manifests.append(json.load(infile))
+        return sorted(manifests, key=lambda manifest: manifest["created"])
+
+    def ingested(self) -> set:
+        """Names of every backup ingested so far, including pruned ones."""
+        try:
+            with open(self.ingested_path, "r", encoding="utf-8") as infile:
+                return {line.strip() for line in infile if line.strip()}
+        except OSError:
+            return set()
+
+    def ingest(self, path: str, compress: bool = False):
+        """
+        Add one backup file as a generation. Returns (manifest, bytes added), or (None, 0) if the backup was already
+        ingested (even if it has since been pruned).
+        """
+        name = os.path.basename(path)
+        if os.path.exists(self.generation_path(name)) or name in self.ingested():
+            return None, 0
+
+        chunks = []
+        added = 0
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as infile:
+            while True:
+                data = infile.read(CHUNK_SIZE)
+                if not data:
+                    break
+                file_hash.update(data)
+                digest, chunk_added = self.put_chunk(data, compress)
+                chunks.append([digest, len(data)])
+                added += chunk_added
+
+        match = TIMESTAMP_PATTERN.search(name)
+        created = int(match.group(1)) / 1000 if match else os.path.getmtime(path)
+        manifest = {
+            "name": name,
+            "created": created,
+            "size": sum(size for _, size in chunks),
+            "sha256": file_hash.hexdigest(),
+            "chunks": chunks,
+        }
+        # The manifest is written last, so a generation only exists once all of its chunks do.
+        atomic_write(self.generation_path(name), json.dumps(manifest, indent=1).encode("utf-8"))
+        with open(self.ingested_path, "a", encoding="utf-8") as outfile:
+            outfile.write(name + "\n")
+        return manifest, added
+
+    def known(self) -> dict:
+        """
+        Every backup the store has seen: name -> SHA-256 for stored generations, and name -> None for backups that
+        were ingested and have since been pruned.
+        """
+        known = dict.fromkeys(self.ingested())
+        known.update((manifest["name"], manifest["sha256"]) for manifest in self.generations())
+        return known
+
+    def holds(self, path: str, known: dict = None) -> bool:
+        """
+        True if the backup at `path` is stored (same checksum) or was ingested and pruned since. Pass the result of
+        `known()` when checking several files.
+        """
+        name = os.path.basename(path)
+        known = self.known() if known is None else known
+        if name not in known:
+            return False
+        if known[name] is None:
+            return True
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as infile:
+            for data in iter(lambda: infile.read(CHUNK_SIZE), b""):
+                file_hash.update(data)
+        return file_hash.hexdigest() == known[name]
+
+    def stream(self, manifest: dict):
+        """Yield the checked chunks of a generation in order."""
+        for digest, size in manifest["chunks"]:
+            data = self.read_chunk(digest)
+            if len(data) != size:
+                raise ValueError(f"damaged chunk {digest}: size mismatch")
+            yield data
+
+    def restore(self, name: str, destination: str):
+        """Rebuild a generation into `destination`. Raises ValueError if it can't be rebuilt intact."""
+        with open(self.generation_path(name), "r", encoding="utf-8") as infile:
+            manifest = json.load(infile)
+
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, name)
+        file_hash = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(destination)), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                for data in self.stream(manifest):
+                    file_hash.update(data)
+                    outfile.write(data)
+            if file_hash.hexdigest() != manifest["sha256"]:
+                raise ValueError(f"{name}: checksum mismatch")
+            os.replace(tmp_path, destination)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return destination
+
+    def verify(self) -> list:
+        """Check every generation by streaming its chunks. Returns a list of problems (empty when all is well)."""
+        problems = []
+        for manifest in self.generations():
+            file_hash = hashlib.sha256()
+            try:
+                for data in self.stream(manifest):
+                    file_hash.update(data)
+            except ValueError as err:
+                problems.append(f"{manifest['name']}: {err}")
+                continue
+            if file_hash.hexdigest() != manifest["sha256"]:
+                problems.append(f"{manifest['name']}: checksum mismatch")
+        return problems
+
+    def prune(self, daily: int, weekly: int, monthly: int, dry_run: bool = False) -> tuple:
+        """
+        Apply the retention policy and delete chunks no longer referenced.
+
+        The newest generation of each of the last `daily` days, `weekly` ISO weeks and `monthly` months is kept.
+        Returns (names of removed generations, number of removed chunks).
+        """
+        generations = self.generations()
+        keep = set()
+        for count, period in ((daily, "%Y-%m-%d"), (weekly, "%G-W%V"), (monthly, "%Y-%m")):
+            seen = []
+            for manifest in reversed(generations):  # newest first
+                key = datetime.fromtimestamp(manifest["created"]).strftime(period)
+                if key not in seen:
+                    if len(seen) >= count:
+                        break
+                    seen.append(key)
+                    keep.add(manifest["name"])
+
+        removed = [manifest["name"] for manifest in generations if manifest["name"] not in keep]
+        referenced = {
+            digest for manifest in generations if manifest["name"] in keep for digest, _ in manifest["chunks"]
+        }
+
+        if dry_run:
+            return removed, 0
+
+        for name in removed:
+            os.unlink(self.generation_path(name))
+
+        removed_chunks = 0
+        for folder, _, file_names in os.walk(self.chunk_folder):
+            for file_name in file_names:
+                if file_name.startswith("."):
+                    continue
+                if file_name.removesuffix(".z") not in referenced:
+                    os.unlink(os.path.join(folder, file_name))
+                    removed_chunks += 1
+        return removed, removed_chunks
+
+
+# =============================================================================
+def main(argv=None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Deduplicating store for UniFi backups.")
+    parser.add_argument("--store", required=True, help="store folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="add new .unf backups from a folder")
+    ingest.add_argument("folder")
+    ingest.add_argument("--compress", action="store_true",
+                        help="zlib-compress new chunks (encrypted .unf backups don't compress)")
+    ingest.add_argument("--remove", action="store_true", help="delete each backup from FOLDER once it's stored")
+
+    commands.add_parser("known", help="list every backup the store has seen (name and checksum, tab-separated)")
+
+    commands.add_parser("list", help="list stored generations")
+
+    prune = commands.add_parser("prune", help="apply the retention policy")
+    prune.add_argument("--daily", type=int, default=7)
+    prune.add_argument("--weekly", type=int, default=4)
+    prune.add_argument("--monthly", type=int, default=12)
+    prune.add_argument("--dry-run", action="store_true")
+
+    commands.add_parser("verify", help="check every generation")
+
+    restore = commands.add_parser("restore", help="rebuild a generation")
+    restore.add_argument("name")
+    restore.add_argument("destination")
+
+    args = parser.parse_args(argv)
+    store = BackupStore(args.store)
+
+    if args.command == "ingest":
+        known = store.known() if args.remove else {}
+        for file_name in sorted(os.listdir(args.folder)):
+            if not file_name.endswith(".unf"):
+                continue
+            path = os.path.join(args.folder, file_name)
+            manifest, added = store.ingest(path, args.compress)
+            if manifest:
+                print(f"Stored {file_name} ({manifest['size']} bytes, {added} new bytes)")
+            if args.remove and (manifest or store.holds(path, known)):
+                os.unlink(path)
+
+    elif args.command == "known":
+        for name, sha256 in sorted(store.known().items()):
+            print(f"{name}\t{sha256 or ''}")
+
+    elif args.command == "list":
+        for manifest in store.generations():
+            print(f"{datetime.fromtimestamp(manifest['created']):%Y-%m-%d %H:%M}  {manifest['size']:>12}  "
+                  f"{manifest['name']}")
+
+    elif args.command == "prune":
+        removed, removed_chunks = store.prune(args.daily, args.weekly, args.monthly, args.dry_run)
+        for name in removed:
+            print(f"{'Would remove' if args.dry_run else 'Removed'} {name}")
+        if not args.dry_run:
+            print(f"Removed {removed_chunks} unreferenced chunks")
+
+    elif args.command == "verify":
+        problems = store.verify()
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        if problems:
+            return 1
+        print("All generations verified")
+
+    elif args.command == "restore":
+        try:
+            print(f"Restored {store.restore(args.name, args.destination)}")
+        except (OSError, ValueError) as err:
+            print(f"Unable to restore {args.name}: {err}", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())